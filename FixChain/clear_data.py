@@ -5,46 +5,143 @@ Author: Assistant
 Usage: python clear_data.py [--rag] [--sonar] [--all]
 """
 
+import io
 import os
 import sys
-import json
+import shutil
 import argparse
 import subprocess
-from datetime import datetime
-from typing import Dict, List
+import threading
+import contextlib
+from functools import cached_property
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, FrozenSet, List, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_YES = frozenset({"y", "yes"})
+
+# Generated files: code_*.py và *.backup.*
+_CODE_PREFIX = "code_"
+_CODE_SUFFIX = ".py"
+_BACKUP_MARKER = ".backup."
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_SONAR_DIR = os.path.normpath(os.path.join(_HERE, "..", "SonarQ"))
 
 # Add project root to path
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(_HERE)
 
 try:
+    from pymongo import DeleteMany, WriteConcern
     from modules.mongodb_service import get_mongo_manager
     MONGODB_AVAILABLE = True
 except ImportError:
     print("⚠️  Warning: MongoDB service not available")
     MONGODB_AVAILABLE = False
 
+# Shared HTTP session cho SonarQube: giữ keep-alive giữa các lần gọi và retry lỗi 5xx tạm thời
+_SONAR = requests.Session()
+_SONAR_ADAPTER = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=10,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+)
+_SONAR.mount("http://", _SONAR_ADAPTER)
+_SONAR.mount("https://", _SONAR_ADAPTER)
+
+def _fast_rmtree(path: str):
+    """Xóa cả thư mục bằng rm -rf / rmdir /s /q thay vì unlink từng file trong Python"""
+    if os.name == "nt":
+        subprocess.run(["cmd", "/c", "rmdir", "/s", "/q", path], check=False)
+    elif shutil.which("rm"):
+        subprocess.run(["rm", "-rf", path], check=False)
+    
+    # Fallback khi không có lệnh hệ thống hoặc lệnh không xóa hết
+    if os.path.exists(path):
+        shutil.rmtree(path, ignore_errors=True)
+
+class _ThreadBufferedStdout:
+    """Proxy cho sys.stdout: thread đang capture ghi vào buffer riêng, các thread khác ghi ra stream gốc.
+    
+    contextlib.redirect_stdout thay sys.stdout cho cả process nên không thể dùng riêng cho từng thread.
+    """
+    
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+    
+    def capture(self, func, *args, **kwargs):
+        """Chạy func trong thread hiện tại, trả về (kết quả, output đã in)"""
+        buffer = io.StringIO()
+        self._local.buffer = buffer
+        try:
+            return func(*args, **kwargs), buffer.getvalue()
+        finally:
+            self._local.buffer = None
+    
+    def write(self, text):
+        return (getattr(self._local, "buffer", None) or self._stream).write(text)
+    
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+    
+    def flush(self):
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            self._stream.flush()
+    
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
 class DataCleaner:
     """Class để clear dữ liệu RAG và SonarQube"""
     
     def __init__(self):
-        self.mongo_manager = None
-        if MONGODB_AVAILABLE:
-            try:
-                self.mongo_manager = get_mongo_manager()
-                print("✅ Connected to MongoDB")
-            except Exception as e:
-                print(f"❌ Failed to connect to MongoDB: {e}")
-                self.mongo_manager = None
+        # Đọc cấu hình từ environment một lần cho cả instance
+        self.project_key = os.getenv('PROJECT_KEY', 'my-service')
+        self.sonar_host = os.getenv('SONAR_HOST', 'http://localhost:9000')
+        self.sonar_token = os.getenv('SONAR_TOKEN')
+        self.source_path = os.getenv('SOURCE_CODE_PATH', 'd:\\ILA\\SonarQ\\source_bug')
+        self.sonar_dir = _SONAR_DIR
+        self._cache_names = self._sonar_cache_names(self.project_key)
+    
+    @cached_property
+    def mongo_manager(self):
+        """Kết nối MongoDB khi cần lần đầu, để --files/--sonar không phải chờ handshake"""
+        if not MONGODB_AVAILABLE:
+            return None
+        try:
+            manager = get_mongo_manager()
+            print("✅ Connected to MongoDB")
+            return manager
+        except Exception as e:
+            print(f"❌ Failed to connect to MongoDB: {e}")
+            return None
+    
+    @staticmethod
+    def _ask(prompt: str) -> bool:
+        """Hỏi xác nhận, chấp nhận y/yes (không phân biệt hoa thường, bỏ khoảng trắng)"""
+        return input(prompt).strip().lower() in _YES
     
-    def clear_rag_data(self, confirm: bool = True) -> bool:
-        """Clear tất cả dữ liệu RAG trong MongoDB"""
+    def clear_rag_data(self, confirm: bool = True, drop: bool = True, verbose: bool = True) -> bool:
+        """Clear tất cả dữ liệu RAG trong MongoDB
+        
+        Args:
+            confirm: Hỏi xác nhận trước khi xóa
+            drop: Drop cả collection (nhanh, xóa luôn indexes). Nếu False thì
+                xóa documents bằng bulk DeleteMany và giữ lại indexes
+            verbose: In kết quả từng collection (warnings luôn được in)
+        """
         if not self.mongo_manager:
             print("❌ MongoDB not available")
             return False
         
         if confirm:
-            response = input("🗑️  Bạn có chắc chắn muốn xóa TẤT CẢ dữ liệu RAG? (y/N): ")
-            if response.lower() != 'y':
+            if not self._ask("🗑️  Bạn có chắc chắn muốn xóa TẤT CẢ dữ liệu RAG? (y/N): "):
                 print("❌ Hủy bỏ xóa dữ liệu RAG")
                 return False
         
@@ -63,18 +160,33 @@ class DataCleaner:
                 "bug_fixes"
             ]
             
+            # Lấy danh sách collection hiện có trong một round-trip, bỏ qua các collection chưa tồn tại
+            existing = set(self.mongo_manager.db.list_collection_names())
+            rag_collections = [name for name in rag_collections if name in existing]
+            if not rag_collections:
+                print("ℹ️  No RAG collections found to clear")
+                return True
+            
             cleared_count = 0
-            for collection_name in rag_collections:
-                try:
-                    collection = self.mongo_manager.get_collection(collection_name)
-                    result = collection.delete_many({})
-                    if result.deleted_count > 0:
-                        print(f"  ✅ Cleared {result.deleted_count} documents from {collection_name}")
-                        cleared_count += result.deleted_count
-                    else:
-                        print(f"  ℹ️  Collection {collection_name} was already empty")
-                except Exception as e:
-                    print(f"  ⚠️  Warning: Could not clear {collection_name}: {e}")
+            buf = []
+            # Mỗi collection là một round-trip độc lập, chạy song song để không cộng dồn RTT
+            with ThreadPoolExecutor(max_workers=min(8, len(rag_collections))) as executor:
+                futures = {
+                    executor.submit(self._drop_one, collection_name, drop): collection_name
+                    for collection_name in rag_collections
+                }
+                for future in as_completed(futures):
+                    collection_name, doc_count, error = future.result()
+                    if error:
+                        buf.append(f"  ⚠️  Warning: Could not clear {collection_name}: {error}\n")
+                        continue
+                    if verbose:
+                        buf.append(f"  ✅ Cleared {doc_count} documents from {collection_name}\n")
+                    cleared_count += doc_count
+            
+            # Ghi một lần thay vì print từng dòng
+            sys.stdout.writelines(buf)
+            sys.stdout.flush()
             
             print(f"✅ RAG data cleared successfully! Total documents removed: {cleared_count}")
             return True
@@ -83,81 +195,107 @@ class DataCleaner:
             print(f"❌ Error clearing RAG data: {e}")
             return False
     
-    def clear_sonar_project_data(self, project_key: str = None, confirm: bool = True) -> bool:
-        """Clear dữ liệu SonarQube project"""
-        if not project_key:
-            project_key = os.getenv('PROJECT_KEY', 'my-service')
+    def _drop_one(self, collection_name: str, drop: bool = True) -> Tuple[str, int, Optional[Exception]]:
+        """Clear một collection, trả về (tên, số documents đã xóa, lỗi nếu có)"""
+        try:
+            collection = self.mongo_manager.get_collection(collection_name)
+            # Đếm từ collection stats (O(1)) trước khi xóa để log
+            doc_count = collection.estimated_document_count()
+            
+            if drop:
+                collection.drop()
+            else:
+                # Giữ lại indexes, không chờ ack từ server
+                collection.with_options(
+                    write_concern=WriteConcern(w=0)
+                ).bulk_write([DeleteMany({})], ordered=False)
+            
+            return collection_name, doc_count, None
+        except Exception as e:
+            return collection_name, 0, e
+    
+    def clear_sonar_project_data(self, project_keys: Union[str, List[str]] = None, confirm: bool = True, probe: bool = None) -> bool:
+        """Clear dữ liệu SonarQube project
+        
+        Args:
+            project_keys: Một hoặc nhiều SonarQube project key (mặc định lấy từ PROJECT_KEY)
+            confirm: Hỏi xác nhận trước khi xóa
+            probe: Kiểm tra project tồn tại trước khi xóa. Mặc định bằng ``confirm``;
+                khi False sẽ POST delete trực tiếp và coi 404 là project đã không còn
+        """
+        if isinstance(project_keys, str):
+            project_keys = [project_keys]
+        project_keys = list(project_keys or []) or [self.project_key]
+        keys_label = ", ".join(project_keys)
+        if probe is None:
+            probe = confirm
         
         if confirm:
-            response = input(f"🗑️  Bạn có chắc chắn muốn xóa dữ liệu SonarQube project '{project_key}'? (y/N): ")
-            if response.lower() != 'y':
+            if not self._ask(f"🗑️  Bạn có chắc chắn muốn xóa dữ liệu SonarQube project '{keys_label}'? (y/N): "):
                 print("❌ Hủy bỏ xóa dữ liệu SonarQube")
                 return False
         
         try:
-            print(f"🧹 Đang clear dữ liệu SonarQube project: {project_key}...")
+            print(f"🧹 Đang clear dữ liệu SonarQube project: {keys_label}...")
             
-            # Lấy thông tin SonarQube từ environment
-            sonar_host = os.getenv('SONAR_HOST', 'http://localhost:9000')
-            sonar_token = os.getenv('SONAR_TOKEN')
+            sonar_host = self.sonar_host
+            sonar_token = self.sonar_token
             
             if not sonar_token:
                 print("❌ SONAR_TOKEN not found in environment")
                 return False
             
             # Xóa project trong SonarQube (nếu có quyền admin)
-            import requests
-            
-            session = requests.Session()
-            session.auth = (sonar_token, "")
+            auth = (sonar_token, "")
             
-            # Kiểm tra project có tồn tại không
-            check_response = session.get(
-                f"{sonar_host}/api/projects/search",
-                params={"projects": project_key}
-            )
-            
-            if check_response.status_code == 200:
-                projects = check_response.json().get('components', [])
-                if projects:
-                    # Xóa project
-                    delete_response = session.post(
-                        f"{sonar_host}/api/projects/delete",
-                        data={"project": project_key}
-                    )
-                    
-                    if delete_response.status_code == 204:
-                        print(f"✅ SonarQube project '{project_key}' deleted successfully")
-                    else:
-                        print(f"⚠️  Could not delete project: {delete_response.text}")
-                        print("ℹ️  You may need admin privileges to delete projects")
-                else:
-                    print(f"ℹ️  Project '{project_key}' not found in SonarQube")
+            if probe:
+                # Kiểm tra project nào đang tồn tại
+                check_response = _SONAR.get(
+                    f"{sonar_host}/api/projects/search",
+                    params={"projects": ",".join(project_keys)},
+                    auth=auth
+                )
+                
+                if check_response.status_code != 200:
+                    print(f"❌ Error checking SonarQube: {check_response.text}")
+                    return False
+                
+                found = {component.get('key') for component in check_response.json().get('components', [])}
+                for project_key in project_keys:
+                    if project_key not in found:
+                        print(f"ℹ️  Project '{project_key}' not found in SonarQube")
+                existing_keys = [key for key in project_keys if key in found]
+                if existing_keys:
+                    self._delete_sonar_projects(sonar_host, existing_keys, auth)
             else:
-                print(f"❌ Error checking SonarQube: {check_response.text}")
-                return False
+                # Bỏ qua bước kiểm tra, POST delete trực tiếp (404 = đã không tồn tại)
+                self._delete_sonar_projects(sonar_host, project_keys, auth)
             
             # Clear local SonarQube cache files
-            sonar_dir = os.path.join(os.path.dirname(__file__), '..', 'SonarQ')
-            cache_files = [
-                f"issues_{project_key}.json",
-                ".sonar",
-                ".scannerwork"
-            ]
+            cache_files = set()
+            for project_key in project_keys:
+                if project_key == self.project_key:
+                    cache_files |= self._cache_names
+                else:
+                    cache_files |= self._sonar_cache_names(project_key)
             
-            for cache_file in cache_files:
-                cache_path = os.path.join(sonar_dir, cache_file)
-                if os.path.exists(cache_path):
-                    try:
-                        if os.path.isfile(cache_path):
-                            os.remove(cache_path)
-                            print(f"  ✅ Removed cache file: {cache_file}")
-                        elif os.path.isdir(cache_path):
-                            import shutil
-                            shutil.rmtree(cache_path)
-                            print(f"  ✅ Removed cache directory: {cache_file}")
-                    except Exception as e:
-                        print(f"  ⚠️  Could not remove {cache_file}: {e}")
+            # Một lần scandir thay cho exists/isfile/isdir trên từng tên, loại entry lấy từ dirent
+            try:
+                with os.scandir(self.sonar_dir) as entries:
+                    for entry in entries:
+                        if entry.name not in cache_files:
+                            continue
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                _fast_rmtree(entry.path)
+                                print(f"  ✅ Removed cache directory: {entry.name}")
+                            else:
+                                os.unlink(entry.path)
+                                print(f"  ✅ Removed cache file: {entry.name}")
+                        except Exception as e:
+                            print(f"  ⚠️  Could not remove {entry.name}: {e}")
+            except FileNotFoundError:
+                pass
             
             return True
             
@@ -165,14 +303,75 @@ class DataCleaner:
             print(f"❌ Error clearing SonarQube data: {e}")
             return False
     
-    def clear_generated_files(self, source_path: str = None, confirm: bool = True) -> bool:
-        """Clear các file code được generate bởi demo"""
-        if not source_path:
-            source_path = os.getenv('SOURCE_CODE_PATH', 'd:\\ILA\\SonarQ\\source_bug')
+    def _delete_sonar_projects(self, sonar_host: str, project_keys: List[str], auth: Tuple[str, str]) -> bool:
+        """Xóa nhiều project trong một POST api/projects/bulk_delete.
+        
+        SonarQube bản cũ không có bulk_delete (404) thì xóa từng project qua api/projects/delete.
+        """
+        if len(project_keys) > 1:
+            bulk_response = _SONAR.post(
+                f"{sonar_host}/api/projects/bulk_delete",
+                data={"projects": ",".join(project_keys)},
+                auth=auth
+            )
+            
+            if bulk_response.status_code == 204:
+                print(f"✅ SonarQube projects '{', '.join(project_keys)}' deleted successfully")
+                return True
+            if bulk_response.status_code != 404:
+                print(f"⚠️  Could not delete projects: {bulk_response.text}")
+                print("ℹ️  You may need admin privileges to delete projects")
+                return False
+        
+        return all([self._delete_sonar_project(sonar_host, project_key, auth) for project_key in project_keys])
+    
+    def _delete_sonar_project(self, sonar_host: str, project_key: str, auth: Tuple[str, str]) -> bool:
+        """Gọi api/projects/delete, coi 204 và 404 đều là thành công"""
+        delete_response = _SONAR.post(
+            f"{sonar_host}/api/projects/delete",
+            data={"project": project_key},
+            auth=auth
+        )
+        
+        if delete_response.status_code == 204:
+            print(f"✅ SonarQube project '{project_key}' deleted successfully")
+            return True
+        if delete_response.status_code == 404:
+            print(f"ℹ️  Project '{project_key}' not found in SonarQube (already absent)")
+            return True
+        
+        print(f"⚠️  Could not delete project: {delete_response.text}")
+        print("ℹ️  You may need admin privileges to delete projects")
+        return False
+    
+    @staticmethod
+    def _sonar_cache_names(project_key: str) -> FrozenSet[str]:
+        """Tên các file/thư mục cache SonarQube local của một project"""
+        return frozenset({f"issues_{project_key}.json", ".sonar", ".scannerwork"})
+    
+    @staticmethod
+    def _iter_generated(path: str):
+        """Yield đường dẫn các file code_*.py và *.backup.* trong một lần scandir"""
+        with os.scandir(path) as entries:
+            for entry in entries:
+                name = entry.name
+                if entry.is_file() and (
+                    (name.startswith(_CODE_PREFIX) and name.endswith(_CODE_SUFFIX)) or _BACKUP_MARKER in name
+                ):
+                    yield entry.path
+    
+    def clear_generated_files(self, source_path: str = None, confirm: bool = True, verbose: bool = True) -> bool:
+        """Clear các file code được generate bởi demo
+        
+        Args:
+            source_path: Thư mục chứa generated files (mặc định lấy từ SOURCE_CODE_PATH)
+            confirm: Hỏi xác nhận trước khi xóa
+            verbose: In tiến độ mỗi 1000 file (lỗi luôn được in)
+        """
+        source_path = source_path or self.source_path
         
         if confirm:
-            response = input(f"🗑️  Bạn có chắc chắn muốn xóa các file generated trong '{source_path}'? (y/N): ")
-            if response.lower() != 'y':
+            if not self._ask(f"🗑️  Bạn có chắc chắn muốn xóa các file generated trong '{source_path}'? (y/N): "):
                 print("❌ Hủy bỏ xóa generated files")
                 return False
         
@@ -183,24 +382,23 @@ class DataCleaner:
                 print(f"❌ Source path not found: {source_path}")
                 return False
             
-            # Tìm và xóa các file code_*.py và backup files
-            import glob
-            
-            patterns = [
-                os.path.join(source_path, "code_*.py"),
-                os.path.join(source_path, "*.backup.*")
-            ]
-            
+            # Tìm và xóa các file code_*.py và backup files, chỉ in tiến độ mỗi 1000 file
             removed_count = 0
-            for pattern in patterns:
-                files = glob.glob(pattern)
-                for file_path in files:
-                    try:
-                        os.remove(file_path)
-                        print(f"  ✅ Removed: {os.path.basename(file_path)}")
-                        removed_count += 1
-                    except Exception as e:
-                        print(f"  ⚠️  Could not remove {file_path}: {e}")
+            errors = []
+            for file_path in self._iter_generated(source_path):
+                try:
+                    os.unlink(file_path)
+                    removed_count += 1
+                    if verbose and removed_count % 1000 == 0:
+                        print(f"  …{removed_count} removed")
+                except OSError as e:
+                    errors.append((file_path, e))
+            
+            buf = [f"  ⚠️  Could not remove {file_path}: {e}\n" for file_path, e in errors[:10]]
+            if len(errors) > 10:
+                buf.append(f"  ⚠️  ... and {len(errors) - 10} more files could not be removed\n")
+            sys.stdout.writelines(buf)
+            sys.stdout.flush()
             
             if removed_count > 0:
                 print(f"✅ Generated files cleared successfully! Total files removed: {removed_count}")
@@ -216,46 +414,59 @@ class DataCleaner:
     def clear_all_data(self, confirm: bool = True) -> bool:
         """Clear tất cả dữ liệu (RAG + SonarQube + Generated files)"""
         if confirm:
-            print("⚠️  CẢNH BÁO: Bạn sắp xóa TẤT CẢ dữ liệu:")
-            print("  - Tất cả dữ liệu RAG trong MongoDB")
-            print("  - SonarQube project data")
-            print("  - Generated code files")
-            print("  - Cache files")
-            response = input("\n🗑️  Bạn có CHẮC CHẮN muốn tiếp tục? (y/N): ")
-            if response.lower() != 'y':
+            sys.stdout.write(
+                "⚠️  CẢNH BÁO: Bạn sắp xóa TẤT CẢ dữ liệu:\n"
+                "  - Tất cả dữ liệu RAG trong MongoDB\n"
+                "  - SonarQube project data\n"
+                "  - Generated code files\n"
+                "  - Cache files\n"
+            )
+            if not self._ask("\n🗑️  Bạn có CHẮC CHẮN muốn tiếp tục? (y/N): "):
                 print("❌ Hủy bỏ clear all data")
                 return False
         
-        print("\n🧹 Bắt đầu clear tất cả dữ liệu...")
-        print("=" * 50)
-        
-        success = True
-        
-        # Clear RAG data
-        print("\n1. Clearing RAG data...")
-        if not self.clear_rag_data(confirm=False):
-            success = False
-        
-        # Clear SonarQube data
-        print("\n2. Clearing SonarQube data...")
-        if not self.clear_sonar_project_data(confirm=False):
-            success = False
+        sys.stdout.write("\n🧹 Bắt đầu clear tất cả dữ liệu...\n" + "=" * 50 + "\n")
         
-        # Clear generated files
-        print("\n3. Clearing generated files...")
-        if not self.clear_generated_files(confirm=False):
-            success = False
+        # Mongo, SonarQube và file system độc lập nhau nên chạy song song,
+        # output của từng bước được in lại theo thứ tự sau khi xong
+        success = self._clear_all_parallel()
         
-        print("\n" + "=" * 50)
         if success:
-            print("✅ Tất cả dữ liệu đã được clear thành công!")
+            summary = "✅ Tất cả dữ liệu đã được clear thành công!"
         else:
-            print("⚠️  Một số dữ liệu có thể chưa được clear hoàn toàn")
+            summary = "⚠️  Một số dữ liệu có thể chưa được clear hoàn toàn"
+        sys.stdout.write("\n" + "=" * 50 + "\n" + summary + "\n")
+        sys.stdout.flush()
         
         return success
     
-    def show_data_status(self) -> Dict:
-        """Hiển thị trạng thái dữ liệu hiện tại"""
+    def _clear_all_parallel(self) -> bool:
+        """Chạy 3 bước clear đồng thời, in output từng bước theo thứ tự 1-2-3"""
+        steps = [
+            ("1. Clearing RAG data...", self.clear_rag_data, (False, True)),
+            ("2. Clearing SonarQube data...", self.clear_sonar_project_data, (None, False)),
+            ("3. Clearing generated files...", self.clear_generated_files, (None, False)),
+        ]
+        
+        stdout = _ThreadBufferedStdout(sys.stdout)
+        with contextlib.redirect_stdout(stdout):
+            with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+                futures = [executor.submit(stdout.capture, func, *args) for _, func, args in steps]
+                results = [future.result() for future in futures]
+        
+        for (title, _, _), (_, output) in zip(steps, results):
+            sys.stdout.write(f"\n{title}\n{output}")
+        sys.stdout.flush()
+        
+        return all(ok for ok, _ in results)
+    
+    def show_data_status(self, exact: bool = False) -> Dict:
+        """Hiển thị trạng thái dữ liệu hiện tại
+        
+        Args:
+            exact: Đếm chính xác bằng count_documents (quét collection) thay vì
+                estimated_document_count (đọc metadata)
+        """
         status = {
             "mongodb_connected": False,
             "rag_documents": 0,
@@ -275,11 +486,15 @@ class DataCleaner:
             # Count RAG documents
             try:
                 rag_collection = self.mongo_manager.get_collection("rag_documents")
-                status["rag_documents"] = rag_collection.count_documents({})
-                print(f"  📄 RAG documents: {status['rag_documents']}")
-                
                 logs_collection = self.mongo_manager.get_collection("execution_logs")
-                status["execution_logs"] = logs_collection.count_documents({})
+                if exact:
+                    status["rag_documents"] = rag_collection.count_documents({})
+                    status["execution_logs"] = logs_collection.count_documents({})
+                else:
+                    status["rag_documents"] = rag_collection.estimated_document_count()
+                    status["execution_logs"] = logs_collection.estimated_document_count()
+                
+                print(f"  📄 RAG documents: {status['rag_documents']}")
                 print(f"  📋 Execution logs: {status['execution_logs']}")
                 
             except Exception as e:
@@ -288,18 +503,13 @@ class DataCleaner:
             print("❌ MongoDB: Not connected")
         
         # Check SonarQube project
-        project_key = os.getenv('PROJECT_KEY', 'my-service')
+        project_key = self.project_key
         try:
-            import requests
-            sonar_host = os.getenv('SONAR_HOST', 'http://localhost:9000')
-            sonar_token = os.getenv('SONAR_TOKEN')
-            
-            if sonar_token:
-                session = requests.Session()
-                session.auth = (sonar_token, "")
-                response = session.get(
-                    f"{sonar_host}/api/projects/search",
-                    params={"projects": project_key}
+            if self.sonar_token:
+                response = _SONAR.get(
+                    f"{self.sonar_host}/api/projects/search",
+                    params={"projects": project_key},
+                    auth=(self.sonar_token, "")
                 )
                 
                 if response.status_code == 200:
@@ -314,16 +524,9 @@ class DataCleaner:
             print(f"⚠️  SonarQube: Error checking status - {e}")
         
         # Check generated files
-        source_path = os.getenv('SOURCE_CODE_PATH', 'd:\\ILA\\SonarQ\\source_bug')
+        source_path = self.source_path
         if os.path.exists(source_path):
-            import glob
-            patterns = [
-                os.path.join(source_path, "code_*.py"),
-                os.path.join(source_path, "*.backup.*")
-            ]
-            
-            for pattern in patterns:
-                status["generated_files"] += len(glob.glob(pattern))
+            status["generated_files"] = sum(1 for _ in self._iter_generated(source_path))
             
             print(f"📁 Generated files: {status['generated_files']}")
         else:
@@ -340,6 +543,7 @@ def main():
         epilog="""
 Examples:
   python clear_data.py --status          # Xem trạng thái dữ liệu
+  python clear_data.py --status --exact  # Xem trạng thái với số documents chính xác
   python clear_data.py --rag             # Clear chỉ dữ liệu RAG
   python clear_data.py --sonar           # Clear chỉ dữ liệu SonarQube
   python clear_data.py --files           # Clear chỉ generated files
@@ -353,6 +557,7 @@ Examples:
     parser.add_argument('--files', action='store_true', help='Clear generated code files')
     parser.add_argument('--all', action='store_true', help='Clear tất cả dữ liệu')
     parser.add_argument('--status', action='store_true', help='Hiển thị trạng thái dữ liệu hiện tại')
+    parser.add_argument('--exact', action='store_true', help='Đếm chính xác số documents khi dùng --status (chậm hơn)')
     parser.add_argument('--no-confirm', action='store_true', help='Không cần confirm (nguy hiểm!)')
     
     args = parser.parse_args()
@@ -362,7 +567,7 @@ Examples:
     
     # Show status if requested
     if args.status:
-        cleaner.show_data_status()
+        cleaner.show_data_status(exact=args.exact)
         return
     
     # If no specific action, show help
@@ -6,16 +6,28 @@ Tích hợp với RAG MongoDB + Gemini Flash 2.0
 """
 
 import os
-import json
+import io
 import csv
+import asyncio
+import hashlib
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 from enum import Enum
+import orjson
+from bson import ObjectId
 from pydantic import BaseModel, Field
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.responses import JSONResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from anyio import to_thread
+from cachetools import TTLCache
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
+from google.api_core.retry import Retry, if_exception_type
+from google.generativeai.client import get_default_generative_client
 from modules.mongodb_service import MongoDBManager
+from modules.embed_cache import EmbedCache, SemanticCache
 from dotenv import load_dotenv
 
 # Load environment variables from root directory
@@ -25,14 +37,33 @@ load_dotenv(root_env_path)
 # Global resources initialized at startup
 mongo_manager: Optional[MongoDBManager] = None
 llm_model = None
+embed_cache: Optional[EmbedCache] = None
+_keepalive_task: Optional[asyncio.Task] = None
+embed_client: Optional[glm.GenerativeServiceClient] = None
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+# Bump khi thay đổi prompt template để vô hiệu hoá cache cũ
+ANALYSIS_PROMPT_VERSION = "2"
+analysis_cache = TTLCache(maxsize=2000, ttl=3600)
+search_answer_cache = SemanticCache(threshold=0.97, maxsize=512, ttl_seconds=3600)
 
 def init_resources():
-    global mongo_manager, llm_model
+    global mongo_manager, llm_model, embed_cache, embed_client
     if llm_model is None:
         genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
         llm_model = genai.GenerativeModel('gemini-2.0-flash-exp')
+    if embed_client is None:
+        # Một client (một channel) dùng chung cho mọi lời gọi embedding
+        embed_client = get_default_generative_client()
     if mongo_manager is None:
         mongo_manager = MongoDBManager()
+        mongo_manager.ensure_bug_indexes()
+    if embed_cache is None:
+        embed_cache = EmbedCache(
+            os.getenv("EMBED_CACHE_PATH", "./.embed_cache.sqlite3"),
+            ttl_seconds=30 * 86400
+        )
 
 # Bug Types Enum
 class BugType(str, Enum):
@@ -104,44 +135,156 @@ class BugAnalysisRequest(BaseModel):
     project: Optional[str] = Field(None, description="Lọc theo project")
     time_range: Optional[str] = Field(None, description="Khoảng thời gian")
 
+# Gemini batch embedding limit (requests per batchEmbedContents call)
+EMBED_BATCH_SIZE = 100
+
+# Max concurrent Gemini embedding calls across all requests
+EMBED_SEM = asyncio.Semaphore(32)
+
+# Timeout/retry cho từng lời gọi embedding
+EMBED_TIMEOUT = 30
+EMBED_RETRY = Retry(
+    predicate=if_exception_type(
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.TooManyRequests,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+    ),
+    initial=0.5,
+    maximum=8,
+    multiplier=2,
+    timeout=60
+)
+
+# Thread limit cho các lời gọi PyMongo (đồng bộ) chạy qua run_in_threadpool
+MONGO_THREAD_LIMIT = 100
+
+# Chu kỳ ping giữ kết nối MongoDB (giây)
+MONGO_KEEPALIVE_SECONDS = 30
+
+# Số bugs mỗi lần import khi stream CSV
+CSV_IMPORT_CHUNK_SIZE = 100
+
+# Đọc bugs để phân tích không cần vector embedding
+BUG_READ_PROJECTION = {"embedding": 0}
+
+# Độ dài preview nội dung bug trong kết quả search
+CONTENT_PREVIEW_CHARS = 200
+
 # Helper Functions
+def _embed_request(text: str) -> glm.EmbedContentRequest:
+    return glm.EmbedContentRequest(
+        model=EMBEDDING_MODEL,
+        content=glm.Content(parts=[glm.Part(text=text)]),
+        task_type=glm.TaskType.RETRIEVAL_DOCUMENT
+    )
+
+def _embed_content_sync(content):
+    """Embed one text or a list (<= 100) of texts through the shared client"""
+    client = embed_client or get_default_generative_client()
+    if isinstance(content, str):
+        response = client.embed_content(
+            _embed_request(content), retry=EMBED_RETRY, timeout=EMBED_TIMEOUT
+        )
+        return {"embedding": list(response.embedding.values)}
+    response = client.batch_embed_contents(
+        glm.BatchEmbedContentsRequest(
+            model=EMBEDDING_MODEL,
+            requests=[_embed_request(text) for text in content]
+        ),
+        retry=EMBED_RETRY,
+        timeout=EMBED_TIMEOUT
+    )
+    return {"embedding": [list(item.values) for item in response.embeddings]}
+
+async def _embed_content(content):
+    """Call Gemini embedding off the event loop, bounded by EMBED_SEM"""
+    async with EMBED_SEM:
+        return await asyncio.to_thread(_embed_content_sync, content)
+
 async def get_gemini_embedding(text: str) -> List[float]:
     """Get embedding from Gemini Flash 2.0"""
+    # SQLite lookups/writes block, so they run off the event loop like the Gemini call
+    if embed_cache is not None:
+        cached = (await asyncio.to_thread(embed_cache.get_many, EMBEDDING_MODEL, [text]))[0]
+        if cached is not None:
+            return cached
     try:
-        result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=text,
-            task_type="retrieval_document"
-        )
-        return result['embedding']
+        result = await _embed_content(text)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating embedding: {str(e)}")
+    if embed_cache is not None:
+        await asyncio.to_thread(embed_cache.put_many, EMBEDDING_MODEL, [text], [result['embedding']])
+    return result['embedding']
+
+async def _get_embedding_or_none(text: str) -> Optional[List[float]]:
+    try:
+        result = await _embed_content(text)
+        return result['embedding']
+    except Exception:
+        return None
+
+async def _embed_chunk(chunk: List[str]) -> List[Optional[List[float]]]:
+    """Embed one chunk with a single batch call, retrying per text if the batch fails"""
+    try:
+        result = await _embed_content(chunk)
+        return result['embedding']
+    except Exception:
+        return list(await asyncio.gather(*(_get_embedding_or_none(text) for text in chunk)))
+
+async def _compute_embeddings_batch(texts: List[str], batch_size: int = EMBED_BATCH_SIZE) -> List[Optional[List[float]]]:
+    chunks = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    results = await asyncio.gather(*(_embed_chunk(chunk) for chunk in chunks))
+    return [embedding for chunk_embeddings in results for embedding in chunk_embeddings]
+
+async def get_gemini_embeddings_batch(texts: List[str], batch_size: int = EMBED_BATCH_SIZE) -> List[Optional[List[float]]]:
+    """Get embeddings for many texts with one Gemini call per ``batch_size`` chunk.
+
+    Texts already in the embedding cache are not sent to Gemini. Chunks are
+    embedded concurrently. If a batch call fails, its texts are retried one
+    by one; texts that still fail get ``None`` so callers can report them
+    individually. Duplicate texts are embedded once and the vector is
+    shared by every position that uses it.
+    """
+    unique_texts = list(dict.fromkeys(texts))
+    if embed_cache is None:
+        vectors = await _compute_embeddings_batch(unique_texts, batch_size)
+    else:
+        vectors = await embed_cache.get_or_compute_many(
+            EMBEDDING_MODEL,
+            unique_texts,
+            lambda missing: _compute_embeddings_batch(missing, batch_size)
+        )
+    if len(unique_texts) == len(texts):
+        return vectors
+    by_text = dict(zip(unique_texts, vectors))
+    return [by_text[text] for text in texts]
+
+# Pre-rendered enum lines for format_bug_content (None -> 'Unknown')
+_TYPE_LINES = {e: f"Type: {e.value}" for e in BugType}
+_SEVERITY_LINES = {None: "Severity: Unknown", **{e: f"Severity: {e.value}" for e in BugSeverity}}
+_STATUS_LINES = {None: "Status: Unknown", **{e: f"Status: {e.value}" for e in BugStatus}}
 
 def format_bug_content(bug: BugItem) -> str:
     """Format bug information into searchable content"""
     content_parts = [
         f"Bug Name: {bug.name}",
         f"Description: {bug.description}",
-        f"Type: {bug.type.value}",
-        f"Severity: {bug.severity.value if bug.severity else 'Unknown'}",
-        f"Status: {bug.status.value if bug.status else 'Unknown'}"
+        _TYPE_LINES[bug.type],
+        _SEVERITY_LINES[bug.severity],
+        _STATUS_LINES[bug.status]
     ]
     
     if bug.labels:
         content_parts.append(f"Labels: {', '.join(bug.labels)}")
-    
     if bug.file_path:
         content_parts.append(f"File: {bug.file_path}")
-    
     if bug.line_number:
         content_parts.append(f"Line: {bug.line_number}")
-    
     if bug.component:
         content_parts.append(f"Component: {bug.component}")
-    
     if bug.resolution:
         content_parts.append(f"Resolution: {bug.resolution}")
-    
     if bug.tags:
         content_parts.append(f"Tags: {', '.join(bug.tags)}")
     
@@ -176,36 +319,35 @@ def create_bug_metadata(bug: BugItem, import_info: Dict) -> Dict:
     # Remove None values
     return {k: v for k, v in metadata.items() if v is not None}
 
-def convert_mongodb_to_json(data):
-    """Convert MongoDB documents to JSON-serializable format"""
-    from bson import ObjectId
-    from datetime import datetime
-    
-    if isinstance(data, list):
-        return [convert_mongodb_to_json(item) for item in data]
-    elif isinstance(data, dict):
-        result = {}
-        for key, value in data.items():
-            result[key] = convert_mongodb_to_json(value)
-        return result
-    elif isinstance(data, ObjectId):
-        return str(data)  # Convert ObjectId to string
-    elif isinstance(data, datetime):
-        return data.isoformat()  # Convert datetime to ISO string
-    else:
-        return data
-
-async def generate_bug_analysis(bugs_data: List[Dict], analysis_type: str) -> str:
-    """Generate analysis using Gemini Flash 2.0"""
-    try:
-        # Convert MongoDB data to JSON-serializable format
-        serializable_data = convert_mongodb_to_json(bugs_data[:10])
-        
-        if analysis_type == "summary":
-            prompt = f"""
-Phân tích tổng quan về {len(bugs_data)} bugs sau đây:
-
-{json.dumps(serializable_data, indent=2, ensure_ascii=False)}
+def _bson_default(obj):
+    """orjson fallback for BSON types (ObjectId -> str); datetimes are native"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps_mongodb_json(data, indent: bool = True) -> str:
+    """Serialize MongoDB documents to a JSON string in one C-level pass"""
+    option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+    return orjson.dumps(data, default=_bson_default, option=option).decode("utf-8")
+
+def _analysis_cache_key(bugs_data: List[Dict], analysis_type: str) -> Optional[str]:
+    """Hash of (analysis_type, canonicalised doc ids, prompt version); None if a bug has no id"""
+    doc_ids = []
+    # Prompt chỉ dùng 10 bugs đầu tiên + tổng số bugs
+    for bug in bugs_data[:10]:
+        doc_id = bug.get("doc_id") or bug.get("_id")
+        if doc_id is None:
+            return None
+        doc_ids.append(str(doc_id))
+    raw = f"{analysis_type}|{len(bugs_data)}|{','.join(sorted(doc_ids))}|{ANALYSIS_PROMPT_VERSION}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+# Prompt templates cho generate_bug_analysis ({n}: số bugs, {data}: JSON)
+ANALYSIS_PROMPTS = {
+    "summary": """
+Phân tích tổng quan về {n} bugs sau đây:
+
+{data}
 
 Hãy cung cấp:
 1. Tổng quan về số lượng bugs theo loại
@@ -215,12 +357,11 @@ Hãy cung cấp:
 5. Xu hướng và pattern
 
 Trả lời bằng tiếng Việt, chi tiết và có cấu trúc.
-"""
-        elif analysis_type == "trend":
-            prompt = f"""
+""",
+    "trend": """
 Phân tích xu hướng bugs từ dữ liệu sau:
 
-{json.dumps(serializable_data, indent=2, ensure_ascii=False)}
+{data}
 
 Hãy phân tích:
 1. Xu hướng theo thời gian
@@ -229,12 +370,11 @@ Hãy phân tích:
 4. Dự đoán và khuyến nghị
 
 Trả lời bằng tiếng Việt.
-"""
-        elif analysis_type == "priority":
-            prompt = f"""
+""",
+    "priority": """
 Đề xuất ưu tiên xử lý bugs dựa trên dữ liệu:
 
-{json.dumps(serializable_data, indent=2, ensure_ascii=False)}
+{data}
 
 Hãy đưa ra:
 1. Danh sách bugs ưu tiên cao
@@ -243,24 +383,11 @@ Hãy đưa ra:
 4. Ước tính effort
 
 Trả lời bằng tiếng Việt.
-"""
-        elif analysis_type == "search_answer":
-            # For search results, create a summary of found bugs
-            bug_summaries = []
-            for bug in serializable_data:
-                metadata = bug.get("metadata", {})
-                bug_summaries.append({
-                    "name": metadata.get("bug_name"),
-                    "type": metadata.get("bug_type"),
-                    "severity": metadata.get("severity"),
-                    "component": metadata.get("component"),
-                    "description": bug.get("content", "")[:200]
-                })
-            
-            prompt = f"""
+""",
+    "search_answer": """
 Dựa trên kết quả tìm kiếm, hãy tóm tắt và phân tích các bugs sau:
 
-{json.dumps(bug_summaries, indent=2, ensure_ascii=False)}
+{data}
 
 Hãy cung cấp:
 1. Tóm tắt các bugs tìm thấy
@@ -269,15 +396,68 @@ Hãy cung cấp:
 4. Mối liên hệ giữa các bugs
 
 Trả lời bằng tiếng Việt, ngắn gọn và súc tích.
-"""
+""",
+}
+ANALYSIS_FALLBACK_PROMPT = "Phân tích dữ liệu bugs: {data}"
+
+async def generate_bug_analysis(
+    bugs_data: List[Dict],
+    analysis_type: str,
+    query_embedding: Optional[List[float]] = None,
+    semantic_key: Optional[str] = None
+) -> str:
+    """Generate analysis using Gemini Flash 2.0, served from cache when possible
+
+    semantic_key scopes the semantic cache: only answers produced under the same
+    key (search filters + limit) are reused for a similar query.
+    """
+    use_cache = llm_model is not None
+    cache_key = _analysis_cache_key(bugs_data, analysis_type) if use_cache else None
+    use_semantic = use_cache and analysis_type == "search_answer" and query_embedding is not None
+
+    if cache_key is not None and cache_key in analysis_cache:
+        return analysis_cache[cache_key]
+    if use_semantic:
+        cached = search_answer_cache.get(query_embedding, key=semantic_key)
+        if cached is not None:
+            return cached
+
+    try:
+        sample = bugs_data[:10]
+        
+        if analysis_type == "search_answer":
+            # For search results, create a summary of found bugs
+            bug_summaries = []
+            for bug in sample:
+                metadata = bug.get("metadata", {})
+                bug_summaries.append({
+                    "name": metadata.get("bug_name"),
+                    "type": metadata.get("bug_type"),
+                    "severity": metadata.get("severity"),
+                    "component": metadata.get("component"),
+                    "description": bug.get("content", "")[:200]
+                })
+            payload = bug_summaries
+        elif analysis_type in ANALYSIS_PROMPTS:
+            payload = sample
         else:
-            prompt = f"Phân tích dữ liệu bugs: {json.dumps(serializable_data[:5], ensure_ascii=False)}"
+            payload = sample[:5]
+        
+        # Compact JSON: fewer input tokens than the indented dump
+        template = ANALYSIS_PROMPTS.get(analysis_type, ANALYSIS_FALLBACK_PROMPT)
+        prompt = template.format(n=len(bugs_data), data=dumps_mongodb_json(payload, indent=False))
         
         response = llm_model.generate_content(prompt)
-        return response.text
+        answer = response.text
     except Exception as e:
         return f"Không thể tạo phân tích: {str(e)}"
 
+    if cache_key is not None:
+        analysis_cache[cache_key] = answer
+    if use_semantic:
+        search_answer_cache.put(query_embedding, answer, key=semantic_key)
+    return answer
+
 # API Endpoints
 from fastapi import APIRouter
 
@@ -286,21 +466,53 @@ app = APIRouter()
 @app.on_event("startup")
 async def startup_event():
     init_resources()
+    # PyMongo chạy trong threadpool; nâng giới hạn mặc định 40 threads của anyio
+    to_thread.current_default_thread_limiter().total_tokens = MONGO_THREAD_LIMIT
+    global _keepalive_task
+    _keepalive_task = asyncio.create_task(_mongo_keepalive())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Dừng task keepalive trước khi event loop đóng"""
+    global _keepalive_task
+    if _keepalive_task is None:
+        return
+    _keepalive_task.cancel()
+    try:
+        await _keepalive_task
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        print(f"Keepalive task failed: {e}")
+    _keepalive_task = None
+
+async def _mongo_keepalive():
+    """Ping MongoDB định kỳ để giữ các connection trong pool luôn sẵn sàng"""
+    while True:
+        await asyncio.sleep(MONGO_KEEPALIVE_SECONDS)
+        if mongo_manager is not None:
+            await run_in_threadpool(mongo_manager.ping)
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint for Bug Management API"""
     try:
         # Test MongoDB connection
-        total_bugs = mongo_manager.documents_collection.count_documents({
-            "metadata.document_type": "bug"
-        })
+        total_bugs = await run_in_threadpool(
+            mongo_manager.documents_collection.count_documents,
+            {"metadata.document_type": "bug"}
+        )
         return {
             "status": "healthy",
             "service": "bug_management",
             "database": "connected",
             "total_bugs": total_bugs,
-            "ai_model": "gemini-2.0-flash-exp"
+            "ai_model": "gemini-2.0-flash-exp",
+            "embedding_cache": await asyncio.to_thread(embed_cache.stats) if embed_cache else None,
+            "analysis_cache": {
+                "size": len(analysis_cache),
+                "semantic": search_answer_cache.stats()
+            }
         }
     except Exception as e:
         return {
@@ -309,50 +521,67 @@ async def health_check():
             "error": str(e)
         }
 
+async def _import_bug_batch(bugs: List[BugItem], import_info: Dict, offset: int = 0):
+    """Embed + bulk insert one batch of bugs; returns (imported_bugs, failed_bugs)
+
+    ``offset`` is added to the reported ``index`` so streamed chunks keep
+    their position in the original input.
+    """
+    imported_bugs = []
+    failed_bugs = []
+    
+    # Format bug content and generate embeddings in batches
+    contents = [format_bug_content(bug) for bug in bugs]
+    embeddings = await get_gemini_embeddings_batch(contents)
+    
+    # Bugs without an embedding fail up front; the rest go in one bulk insert
+    pending = []
+    for i, bug in enumerate(bugs):
+        if embeddings[i] is None:
+            failed_bugs.append({
+                "bug_name": bug.name,
+                "error": "Error generating embedding",
+                "index": offset + i
+            })
+            continue
+        pending.append(i)
+    
+    if pending:
+        doc_ids, errors = await run_in_threadpool(
+            mongo_manager.bulk_add_documents,
+            contents=[contents[i] for i in pending],
+            embeddings=[embeddings[i] for i in pending],
+            metadatas=[create_bug_metadata(bugs[i], import_info) for i in pending]
+        )
+        for pos, i in enumerate(pending):
+            bug = bugs[i]
+            if pos in errors:
+                failed_bugs.append({
+                    "bug_name": bug.name,
+                    "error": errors[pos],
+                    "index": offset + i
+                })
+                continue
+            imported_bugs.append({
+                "bug_name": bug.name,
+                "document_id": doc_ids[pos],
+                "type": bug.type.value,
+                "severity": bug.severity.value if bug.severity else None
+            })
+    failed_bugs.sort(key=lambda item: item["index"])
+    return imported_bugs, failed_bugs
+
 @app.post("/bugs/import")
 async def import_bugs(request: BugImportRequest):
     """Import danh sách bugs vào hệ thống"""
     try:
-        imported_bugs = []
-        failed_bugs = []
-        
         import_info = {
             "project_name": request.project_name,
             "import_source": request.import_source,
             "batch_name": request.batch_name or f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         }
         
-        for i, bug in enumerate(request.bugs):
-            try:
-                # Format bug content for embedding
-                bug_content = format_bug_content(bug)
-                
-                # Generate embedding
-                embedding = await get_gemini_embedding(bug_content)
-                
-                # Create metadata
-                metadata = create_bug_metadata(bug, import_info)
-                
-                # Add to MongoDB
-                doc_id = mongo_manager.add_document(
-                    content=bug_content,
-                    embedding=embedding,
-                    metadata=metadata
-                )
-                
-                imported_bugs.append({
-                    "bug_name": bug.name,
-                    "document_id": doc_id,
-                    "type": bug.type.value,
-                    "severity": bug.severity.value if bug.severity else None
-                })
-                
-            except Exception as e:
-                failed_bugs.append({
-                    "bug_name": bug.name,
-                    "error": str(e),
-                    "index": i
-                })
+        imported_bugs, failed_bugs = await _import_bug_batch(request.bugs, import_info)
         
         return {
             "message": f"Import completed: {len(imported_bugs)} success, {len(failed_bugs)} failed",
@@ -374,43 +603,34 @@ async def search_bugs(request: BugSearchRequest):
         # Generate query embedding
         query_embedding = await get_gemini_embedding(request.query)
         
-        # Search in MongoDB
-        results = mongo_manager.search_by_embedding(
+        # Search in MongoDB, pre-filtered on metadata so only matching bugs are scored
+        metadata_filter: Dict[str, Any] = {}
+        if request.bug_types:
+            metadata_filter["metadata.bug_type"] = {"$in": sorted({t.value for t in request.bug_types})}
+        if request.severities:
+            metadata_filter["metadata.severity"] = {"$in": sorted({s.value for s in request.severities})}
+        if request.labels:
+            metadata_filter["metadata.labels"] = {"$in": sorted(set(request.labels))}
+        if request.project:
+            metadata_filter["metadata.project"] = request.project
+        
+        filtered_results = await run_in_threadpool(
+            mongo_manager.search_by_embedding,
             query_embedding=query_embedding,
-            top_k=request.limit * 2  # Get more results for filtering
+            top_k=request.limit,
+            metadata_filter=metadata_filter or None
         )
         
-        # Filter results based on criteria
-        filtered_results = []
-        for result in results:
-            metadata = result.get("metadata", {})
-            
-            # Filter by bug type
-            if request.bug_types and metadata.get("bug_type") not in [t.value for t in request.bug_types]:
-                continue
-            
-            # Filter by severity
-            if request.severities and metadata.get("severity") not in [s.value for s in request.severities]:
-                continue
-            
-            # Filter by labels
-            if request.labels:
-                bug_labels = metadata.get("labels", [])
-                if not any(label in bug_labels for label in request.labels):
-                    continue
-            
-            # Filter by project
-            if request.project and metadata.get("project") != request.project:
-                continue
-            
-            filtered_results.append(result)
-            
-            if len(filtered_results) >= request.limit:
-                break
-        
         # Generate AI answer
         if filtered_results:
-            answer = await generate_bug_analysis(filtered_results, "search_answer")
+            # Semantic cache chỉ dùng lại câu trả lời của cùng bộ filter + limit
+            semantic_key = dumps_mongodb_json({"filter": metadata_filter, "limit": request.limit}, indent=False)
+            answer = await generate_bug_analysis(
+                filtered_results,
+                "search_answer",
+                query_embedding,
+                semantic_key
+            )
         else:
             answer = "Không tìm thấy bugs phù hợp với tiêu chí tìm kiếm."
         
@@ -418,6 +638,7 @@ async def search_bugs(request: BugSearchRequest):
         bugs_info = []
         for result in filtered_results:
             metadata = result.get("metadata", {})
+            content = result["content"]
             bugs_info.append({
                 "bug_name": metadata.get("bug_name"),
                 "type": metadata.get("bug_type"),
@@ -427,7 +648,7 @@ async def search_bugs(request: BugSearchRequest):
                 "project": metadata.get("project"),
                 "labels": metadata.get("labels", []),
                 "similarity_score": result.get("similarity", 0),
-                "content_preview": result["content"][:200] + "..." if len(result["content"]) > 200 else result["content"]
+                "content_preview": content[:CONTENT_PREVIEW_CHARS] + "..." if len(content) > CONTENT_PREVIEW_CHARS else content
             })
         
         return {
@@ -450,14 +671,11 @@ async def search_bugs(request: BugSearchRequest):
 async def analyze_bugs(request: BugAnalysisRequest):
     """Phân tích bugs với AI"""
     try:
-        # Get bugs data from MongoDB
+        # Sample docs for the LLM and full counts for the stats in one round trip
         if request.bug_ids:
             # Get specific bugs by IDs
-            bugs_data = []
-            for bug_id in request.bug_ids:
-                doc = mongo_manager.documents_collection.find_one({"doc_id": bug_id})
-                if doc:
-                    bugs_data.append(doc)
+            query_filter = {"doc_id": {"$in": request.bug_ids}}
+            sample_stages = [{"$project": BUG_READ_PROJECTION}]
         else:
             # Get all bugs with filters
             query_filter = {"metadata.document_type": "bug"}
@@ -465,7 +683,28 @@ async def analyze_bugs(request: BugAnalysisRequest):
             if request.project:
                 query_filter["metadata.project"] = request.project
             
-            bugs_data = list(mongo_manager.documents_collection.find(query_filter).limit(100))
+            sample_stages = [{"$limit": 100}, {"$project": BUG_READ_PROJECTION}]
+        
+        pipeline = [
+            {"$match": query_filter},
+            {"$facet": {
+                "sample": sample_stages,
+                "total": [{"$count": "total"}],
+                "by_type": [{"$group": {"_id": "$metadata.bug_type", "count": {"$sum": 1}}}],
+                "by_severity": [{"$group": {"_id": "$metadata.severity", "count": {"$sum": 1}}}],
+                "by_status": [{"$group": {"_id": "$metadata.status", "count": {"$sum": 1}}}],
+                "projects": [{"$group": {"_id": "$metadata.project"}}]
+            }}
+        ]
+        facet = await run_in_threadpool(
+            lambda: next(mongo_manager.documents_collection.aggregate(pipeline), {})
+        )
+        bugs_data = facet.get("sample", [])
+        
+        if request.bug_ids:
+            # Keep the caller's order
+            position = {bug_id: i for i, bug_id in enumerate(request.bug_ids)}
+            bugs_data.sort(key=lambda doc: position.get(doc.get("doc_id"), len(position)))
         
         if not bugs_data:
             return {
@@ -476,36 +715,20 @@ async def analyze_bugs(request: BugAnalysisRequest):
         # Generate analysis
         analysis = await generate_bug_analysis(bugs_data, request.analysis_type)
         
-        # Calculate statistics
+        def _counts(field: str) -> Dict[str, int]:
+            return {
+                (group["_id"] if group["_id"] is not None else "Unknown"): group["count"]
+                for group in facet.get(field, [])
+            }
+        
         stats = {
-            "total_bugs": len(bugs_data),
-            "by_type": {},
-            "by_severity": {},
-            "by_status": {},
-            "projects": set()
+            "total_bugs": facet["total"][0]["total"] if facet.get("total") else len(bugs_data),
+            "by_type": _counts("by_type"),
+            "by_severity": _counts("by_severity"),
+            "by_status": _counts("by_status"),
+            "projects": [group["_id"] for group in facet.get("projects", []) if group["_id"]]
         }
         
-        for bug in bugs_data:
-            metadata = bug.get("metadata", {})
-            
-            # Count by type
-            bug_type = metadata.get("bug_type", "Unknown")
-            stats["by_type"][bug_type] = stats["by_type"].get(bug_type, 0) + 1
-            
-            # Count by severity
-            severity = metadata.get("severity", "Unknown")
-            stats["by_severity"][severity] = stats["by_severity"].get(severity, 0) + 1
-            
-            # Count by status
-            status = metadata.get("status", "Unknown")
-            stats["by_status"][status] = stats["by_status"].get(status, 0) + 1
-            
-            # Collect projects
-            if metadata.get("project"):
-                stats["projects"].add(metadata["project"])
-        
-        stats["projects"] = list(stats["projects"])
-        
         return {
             "analysis_type": request.analysis_type,
             "analysis": analysis,
@@ -520,26 +743,30 @@ async def analyze_bugs(request: BugAnalysisRequest):
 async def get_bug_stats():
     """Lấy thống kê tổng quan về bugs"""
     try:
-        # Count total bugs
-        total_bugs = mongo_manager.documents_collection.count_documents({
-            "metadata.document_type": "bug"
-        })
-        
-        # Get aggregation stats
+        # Count + group in one round trip; project only the grouped fields early
         pipeline = [
             {"$match": {"metadata.document_type": "bug"}},
-            {"$group": {
-                "_id": {
-                    "type": "$metadata.bug_type",
-                    "severity": "$metadata.severity",
-                    "status": "$metadata.status",
-                    "project": "$metadata.project"
-                },
-                "count": {"$sum": 1}
+            {"$project": {
+                "_id": 0,
+                "t": "$metadata.bug_type",
+                "s": "$metadata.severity",
+                "st": "$metadata.status",
+                "p": "$metadata.project"
+            }},
+            {"$facet": {
+                "total": [{"$count": "total"}],
+                "groups": [{"$group": {
+                    "_id": {"type": "$t", "severity": "$s", "status": "$st", "project": "$p"},
+                    "count": {"$sum": 1}
+                }}]
             }}
         ]
         
-        aggregation_results = list(mongo_manager.documents_collection.aggregate(pipeline))
+        facet = await run_in_threadpool(
+            lambda: next(mongo_manager.documents_collection.aggregate(pipeline), {})
+        )
+        total_bugs = facet["total"][0]["total"] if facet.get("total") else 0
+        aggregation_results = facet.get("groups", [])
         
         # Process results
         stats = {
@@ -573,6 +800,68 @@ async def get_bug_stats():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Stats failed: {str(e)}")
 
+# Enum lookups cho CSV rows (value -> member)
+_BUG_TYPES = {e.value: e for e in BugType}
+_BUG_SEVERITIES = {e.value: e for e in BugSeverity}
+_BUG_STATUSES = {e.value: e for e in BugStatus}
+
+def _lookup_enum(members: Dict[str, Enum], value: str, enum_name: str) -> Enum:
+    try:
+        return members[value]
+    except KeyError:
+        raise ValueError(f"'{value}' is not a valid {enum_name}") from None
+
+def _parse_csv_bug(row: Dict[str, str]) -> BugItem:
+    """Build a BugItem from one CSV row
+
+    Enum fields are checked with dict lookups and every field is already of
+    the right type, so the model is built with ``model_construct`` and skips
+    Pydantic validation (the JSON import endpoint still validates fully).
+    """
+    line_number = row.get('line_number')
+    labels = row.get('labels')
+    tags = row.get('tags')
+    return BugItem.model_construct(
+        name=row.get('name') or '',
+        description=row.get('description') or '',
+        type=_lookup_enum(_BUG_TYPES, row.get('type', 'BUG'), 'BugType'),
+        severity=_lookup_enum(_BUG_SEVERITIES, row['severity'], 'BugSeverity') if row.get('severity') else BugSeverity.MAJOR,
+        status=_lookup_enum(_BUG_STATUSES, row['status'], 'BugStatus') if row.get('status') else BugStatus.OPEN,
+        labels=labels.split(',') if labels else [],
+        file_path=row.get('file_path'),
+        line_number=int(line_number) if line_number else None,
+        component=row.get('component'),
+        project=row.get('project'),
+        assignee=row.get('assignee'),
+        reporter=row.get('reporter'),
+        created_date=row.get('created_date'),
+        updated_date=row.get('updated_date'),
+        resolution=row.get('resolution'),
+        effort=row.get('effort'),
+        debt=row.get('debt'),
+        tags=tags.split(',') if tags else []
+    )
+
+def _iter_csv_bug_chunks(binary_file, chunk_size: int = CSV_IMPORT_CHUNK_SIZE):
+    """Parse the uploaded CSV row by row, yielding lists of BugItem"""
+    text_file = io.TextIOWrapper(binary_file, encoding='utf-8', newline='')
+    try:
+        chunk = []
+        for row in csv.DictReader(text_file):
+            try:
+                chunk.append(_parse_csv_bug(row))
+            except Exception as e:
+                print(f"Error parsing row: {row}, error: {e}")
+                continue
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        # Don't let the wrapper close the upload's underlying file
+        text_file.detach()
+
 @app.post("/bugs/import/csv")
 async def import_bugs_from_csv(file: UploadFile = File(...)):
     """Import bugs từ CSV file"""
@@ -580,57 +869,38 @@ async def import_bugs_from_csv(file: UploadFile = File(...)):
         if not file.filename.endswith('.csv'):
             raise HTTPException(status_code=400, detail="File must be CSV format")
         
-        # Read CSV content
-        content = await file.read()
-        csv_content = content.decode('utf-8')
-        
-        # Parse CSV
-        csv_reader = csv.DictReader(csv_content.splitlines())
-        bugs = []
-        
-        for row in csv_reader:
-            try:
-                bug = BugItem(
-                    name=row.get('name', ''),
-                    description=row.get('description', ''),
-                    type=BugType(row.get('type', 'BUG')),
-                    severity=BugSeverity(row.get('severity', 'MAJOR')) if row.get('severity') else BugSeverity.MAJOR,
-                    status=BugStatus(row.get('status', 'OPEN')) if row.get('status') else BugStatus.OPEN,
-                    labels=row.get('labels', '').split(',') if row.get('labels') else [],
-                    file_path=row.get('file_path'),
-                    line_number=int(row.get('line_number', 0)) if row.get('line_number') else None,
-                    component=row.get('component'),
-                    project=row.get('project'),
-                    assignee=row.get('assignee'),
-                    reporter=row.get('reporter'),
-                    created_date=row.get('created_date'),
-                    updated_date=row.get('updated_date'),
-                    resolution=row.get('resolution'),
-                    effort=row.get('effort'),
-                    debt=row.get('debt'),
-                    tags=row.get('tags', '').split(',') if row.get('tags') else []
-                )
-                bugs.append(bug)
-            except Exception as e:
-                print(f"Error parsing row: {row}, error: {e}")
-                continue
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        project_name = f"csv_import_{timestamp}"
+        import_info = {
+            "project_name": project_name,
+            "import_source": "csv_file",
+            "batch_name": f"csv_{file.filename}_{timestamp}"
+        }
         
-        if not bugs:
+        # Stream-parse in a worker thread and import chunk by chunk
+        imported_bugs = []
+        failed_bugs = []
+        total_rows = 0
+        async for bugs in iterate_in_threadpool(_iter_csv_bug_chunks(file.file)):
+            imported, failed = await _import_bug_batch(bugs, import_info, offset=total_rows)
+            imported_bugs.extend(imported)
+            failed_bugs.extend(failed)
+            total_rows += len(bugs)
+        
+        if not total_rows:
             raise HTTPException(status_code=400, detail="No valid bugs found in CSV")
         
-        # Import bugs
-        import_request = BugImportRequest(
-            bugs=bugs,
-            project_name=f"csv_import_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-            import_source="csv_file",
-            batch_name=f"csv_{file.filename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        )
-        
-        result = await import_bugs(import_request)
-        result["source_file"] = file.filename
-        result["total_rows_processed"] = len(bugs)
-        
-        return result
+        return {
+            "message": f"Import completed: {len(imported_bugs)} success, {len(failed_bugs)} failed",
+            "batch_name": import_info["batch_name"],
+            "imported_count": len(imported_bugs),
+            "failed_count": len(failed_bugs),
+            "imported_bugs": imported_bugs,
+            "failed_bugs": failed_bugs,
+            "project": project_name,
+            "source_file": file.filename,
+            "total_rows_processed": total_rows
+        }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"CSV import failed: {str(e)}")
@@ -5,17 +5,30 @@ Provides endpoints for importing bugs as RAG documents and fixing bugs
 """
 
 import os
+import re
 import json
+import asyncio
+import hashlib
+import time
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from typing import List, Dict, Any, Literal, Optional
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, UploadFile, File, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+from cachetools import LRUCache, TTLCache
 from pydantic import BaseModel, Field
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.generativeai.client import get_default_generative_client
 from dotenv import load_dotenv
 import numpy as np
+import orjson
 from modules.mongodb_service import MongoDBManager, get_mongo_manager
+from modules.embed_cache import SemanticCache, VectorIndex
 import uvicorn
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError
 
 # Load environment variables from root directory
 root_env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.env')
@@ -26,11 +39,73 @@ gemini_api_key = os.getenv("GEMINI_API_KEY")
 if not gemini_api_key:
     raise ValueError("GEMINI_API_KEY not found in environment variables")
 
-genai.configure(api_key=gemini_api_key)
+genai.configure(api_key=gemini_api_key, transport="grpc")
+
+# Model handle built once per process
+_GEMINI_FLASH = genai.GenerativeModel('gemini-2.0-flash-exp')
+
+# Shared gRPC client: one HTTP/2 channel reused (and multiplexed) by every embed call
+EMBEDDING_MODEL = "models/text-embedding-004"
+_GEMINI_EMBED_CLIENT = get_default_generative_client()
+
+# Static instructions for suggest_bug_fix; kept as the leading prompt part so
+# every request shares the same prefix
+SUGGEST_FIX_INSTRUCTIONS = """Analyze the bug below and provide fix suggestions.
+
+Please provide:
+1. Root cause analysis
+2. Recommended fix approach
+3. Code suggestions (if applicable)
+4. Potential risks or considerations
+5. Testing recommendations
+
+Format your response in a clear, structured manner.
+"""
+
+# Fixed bugs fetched alongside the target bug in suggest_bug_fix, narrowed by type afterwards
+SIMILAR_FIX_CANDIDATES = 50
+SIMILAR_FIX_PROJECTION = {
+    "metadata.bug_type": 1,
+    "metadata.bug_name": 1,
+    "metadata.fix_record": 1
+}
 
 # Initialize APIRouter
 app = APIRouter()
 
+EMBEDDING_DIM = 768
+
+# Text fallback fetches this many candidates per result, then ranks them by cosine
+FALLBACK_CANDIDATE_FACTOR = 4
+
+# Cap concurrent Gemini embedding batches to stay under rate limits
+EMBED_SEMAPHORE = asyncio.Semaphore(8)
+
+# Search result caches: exact query string first, then query-embedding similarity
+SEARCH_CACHE_TTL = 3600
+SEARCH_SEMANTIC_THRESHOLD = 0.95
+_exact_search_cache = TTLCache(maxsize=1024, ttl=SEARCH_CACHE_TTL)
+_semantic_search_caches = TTLCache(maxsize=128, ttl=SEARCH_CACHE_TTL)
+
+# Locality reuse: keep a wider top-N pool per query and re-rank it for nearby queries
+LOCALITY_POOL_SIZE = 20
+# text-embedding-004 scores unrelated queries around 0.85, so only near-paraphrases reuse a pool
+LOCALITY_THRESHOLD = float(os.getenv("RAG_LOCALITY_THRESHOLD", "0.95"))
+_locality_pools = TTLCache(maxsize=128, ttl=SEARCH_CACHE_TTL)
+
+# In-process vector index for small collections (skips the $vectorSearch round trip).
+# Local writes update it in place; after the TTL it is rebuilt from MongoDB in the
+# background (the old index keeps serving) so writes from other workers show up
+VECTOR_INDEX_MAX_DOCS = int(os.getenv("RAG_VECTOR_INDEX_MAX_DOCS", "20000"))
+VECTOR_INDEX_TTL = 300
+VECTOR_INDEX_LOAD_BATCH = 1000
+# collection name -> (loaded_at, VectorIndex or None when too large / failed)
+_vector_indexes = LRUCache(maxsize=16)
+_vector_index_lock = asyncio.Lock()
+# collection name -> local writes made while a rebuild is in flight, replayed on swap
+_vector_index_pending: Dict[str, List[tuple]] = {}
+_vector_index_tasks = set()
+
 # Pydantic Models
 class BugRAGItem(BaseModel):
     """Bug item for RAG import"""
@@ -52,6 +127,7 @@ class BugRAGImportRequest(BaseModel):
     bugs: List[BugRAGItem]
     collection_name: str = Field(default="bug_rag_documents", description="MongoDB collection name")
     generate_embeddings: bool = Field(default=True, description="Whether to generate embeddings")
+    fast_insert: bool = Field(default=False, description="Insert without write acknowledgement (w=0)")
 
 class BugFixRequest(BaseModel):
     """Request for fixing a bug"""
@@ -68,6 +144,10 @@ class BugSearchRequest(BaseModel):
     collection_name: str = Field(default="bug_rag_documents", description="MongoDB collection name")
     top_k: int = Field(default=5, description="Number of results to return")
     filters: Dict[str, Any] = Field(default_factory=dict, description="Additional filters")
+    search_mode: Literal["auto", "vector", "filter"] = Field(
+        default="auto",
+        description="auto: filter-only for empty/short queries with filters; vector: always embed; filter: never embed"
+    )
 
 class BugFixSuggestionRequest(BaseModel):
     """Request for AI-powered bug fix suggestions"""
@@ -76,59 +156,295 @@ class BugFixSuggestionRequest(BaseModel):
     include_similar_fixes: bool = Field(default=True, description="Include similar fixes from RAG")
 
 # Helper Functions
+def _embed_request(text: str) -> glm.EmbedContentRequest:
+    return glm.EmbedContentRequest(
+        model=EMBEDDING_MODEL,
+        content=glm.Content(parts=[glm.Part(text=text)]),
+        task_type=glm.TaskType.RETRIEVAL_DOCUMENT
+    )
+
 def generate_gemini_embedding(text: str) -> List[float]:
     """Generate embedding using Gemini"""
     try:
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=text,
-            task_type="retrieval_document"
-        )
-        return result['embedding']
+        response = _GEMINI_EMBED_CLIENT.embed_content(_embed_request(text))
+        return list(response.embedding.values)
     except Exception as e:
         print(f"Error generating embedding: {e}")
-        return [0.0] * 768  # Default embedding size
+        return [0.0] * EMBEDDING_DIM  # Default embedding size
+
+def _embed_batch_sync(chunk: List[str]) -> List[List[float]]:
+    """One Gemini embed_content call for a chunk of texts (blocking)"""
+    try:
+        response = _GEMINI_EMBED_CLIENT.batch_embed_contents(
+            glm.BatchEmbedContentsRequest(
+                model=EMBEDDING_MODEL,
+                requests=[_embed_request(text) for text in chunk]
+            )
+        )
+        return [list(item.values) for item in response.embeddings]
+    except Exception as e:
+        print(f"Error generating batch embedding: {e}")
+        # Fall back to one call per text so one bad input doesn't sink the chunk
+        return [generate_gemini_embedding(text) for text in chunk]
+
+async def generate_gemini_embeddings_batch(texts: List[str], batch_size: int = 64) -> List[List[float]]:
+    """Generate embeddings for many texts; chunks run concurrently off the event loop"""
+    async def _run(chunk: List[str]) -> List[List[float]]:
+        async with EMBED_SEMAPHORE:
+            return await asyncio.to_thread(_embed_batch_sync, chunk)
+    
+    results = await asyncio.gather(*(
+        _run(texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)
+    ))
+    return [embedding for chunk in results for embedding in chunk]
+
+async def generate_gemini_embedding_async(text: str) -> List[float]:
+    """``generate_gemini_embedding`` in a worker thread so it doesn't block the loop"""
+    return await asyncio.to_thread(generate_gemini_embedding, text)
+
+def _search_signature(request: "BugSearchRequest") -> str:
+    """Everything except the query text that changes a search result"""
+    return json.dumps(
+        {"collection": request.collection_name, "top_k": request.top_k, "filters": request.filters},
+        sort_keys=True,
+        default=str
+    )
+
+def _exact_search_key(request: "BugSearchRequest") -> str:
+    raw = f"{_search_signature(request)}|{request.query}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _semantic_search_cache(signature: str) -> SemanticCache:
+    cache = _semantic_search_caches.get(signature)
+    if cache is None:
+        cache = SemanticCache(
+            threshold=SEARCH_SEMANTIC_THRESHOLD, maxsize=256, ttl_seconds=SEARCH_CACHE_TTL
+        )
+        _semantic_search_caches[signature] = cache
+    return cache
+
+def _locality_pool_cache(request: "BugSearchRequest") -> SemanticCache:
+    """Pools depend on collection + filters only; any top_k <= pool size can reuse them"""
+    signature = json.dumps(
+        {"collection": request.collection_name, "filters": request.filters}, sort_keys=True, default=str
+    )
+    cache = _locality_pools.get(signature)
+    if cache is None:
+        cache = SemanticCache(threshold=LOCALITY_THRESHOLD, maxsize=64, ttl_seconds=SEARCH_CACHE_TTL)
+        _locality_pools[signature] = cache
+    return cache
+
+def _build_locality_pool(results: List[Dict]) -> Optional[Dict[str, Any]]:
+    """Pool of search hits plus their int8-quantised unit embeddings, or None if unusable
+
+    Rows are L2-normalised, then scalar-quantised to int8 with one scale per
+    row (4x smaller than float32), so cached pools stay cheap to hold.
+    """
+    vectors = [doc.get("embedding") for doc in results]
+    if not results or any(not vector for vector in vectors):
+        return None
+    try:
+        matrix = np.asarray(vectors, dtype=np.float32)
+    except ValueError:
+        return None  # ragged dimensions
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    scales = np.abs(matrix).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.round(matrix / scales[:, np.newaxis]).astype(np.int8)
+    return {"docs": _without_embedding(results), "codes": codes, "scales": scales.astype(np.float32)}
+
+def _top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the ``top_k`` highest scores, best first"""
+    if top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates])]
+
+def _rerank_locality_pool(pool: Dict[str, Any], query_embedding: List[float], top_k: int) -> List[Dict]:
+    """Re-rank a cached pool against a new query by (dequantised) cosine similarity"""
+    query = np.asarray(query_embedding, dtype=np.float32)
+    scores = (pool["codes"] @ query) * pool["scales"]
+    return [pool["docs"][i] for i in _top_k_indices(scores, top_k)]
+
+def _use_filter_only(request: "BugSearchRequest") -> bool:
+    """Whether the search can skip embedding and run a plain metadata query"""
+    if request.search_mode != "auto":
+        return request.search_mode == "filter"
+    return bool(request.filters) and len(request.query.split()) <= 2
+
+_indexed_collections = set()
+
+def _ensure_index(collection, keys, name, **kwargs):
+    """Create an index once per collection and process"""
+    if (collection.name, name) in _indexed_collections:
+        return
+    try:
+        collection.create_index(keys, name=name, **kwargs)
+        _indexed_collections.add((collection.name, name))
+    except Exception as e:
+        print(f"Error creating index {name}: {e}")
+
+def _ensure_stats_index(collection):
+    """Compound index so the stats projection/groups can be served from the index"""
+    _ensure_index(
+        collection,
+        [("metadata.status", 1), ("metadata.bug_type", 1), ("metadata.severity", 1)],
+        "rag_bug_stats_idx"
+    )
+
+def _ensure_content_hash_index(collection):
+    """Unique content hash so re-imports upsert instead of duplicating documents"""
+    _ensure_index(
+        collection,
+        [("content_hash", 1)],
+        "rag_bug_content_hash_idx",
+        unique=True,
+        partialFilterExpression={"content_hash": {"$exists": True}}
+    )
+
+def _ensure_text_index(collection):
+    """Text index backing the keyword fallback of search_bugs_in_rag"""
+    _ensure_index(
+        collection,
+        [("content", "text"), ("metadata.bug_name", "text"), ("metadata.description", "text")],
+        "rag_bug_text_idx"
+    )
+
+def _ensure_content_lower_index(collection):
+    """Index the lowercased content used by the regex fallback"""
+    _ensure_index(collection, [("content_lower", 1)], "rag_bug_content_lower_idx")
+
+CONTENT_LOWER_BACKFILL_BATCH = 500
+
+def backfill_content_lower(collection) -> int:
+    """Migration: fill content_lower where missing, lowercased in Python like every write path.
+
+    Mongo's $toLower only folds ASCII, so it would not match a query lowered
+    with str.lower() on Vietnamese text ("LỖI").
+    """
+    updated = 0
+    operations = []
+    for doc in collection.find({"content_lower": None, "content": {"$type": "string"}}, {"content": 1}):
+        operations.append(UpdateOne(
+            {"_id": doc["_id"], "content": doc["content"]},
+            {"$set": {"content_lower": doc["content"].lower()}}
+        ))
+        if len(operations) >= CONTENT_LOWER_BACKFILL_BATCH:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+@app.on_event("startup")
+async def migrate_content_lower():
+    """Backfill content_lower for bug documents written before the field existed"""
+    try:
+        updated = await asyncio.to_thread(
+            lambda: backfill_content_lower(get_mongo_manager().get_collection("bug_rag_documents"))
+        )
+        if updated:
+            print(f"Backfilled content_lower for {updated} bug documents")
+    except Exception as e:
+        print(f"Error backfilling content_lower: {e}")
+
+def content_hash(content: str) -> str:
+    """Stable hash of RAG content used to skip re-embedding identical bugs"""
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+def _load_vector_index(collection):
+    """Build the in-process index from stored embeddings; None if the collection is too large"""
+    embedded = {"embedding": {"$type": "array"}}
+    count = collection.count_documents(embedded)
+    if count > VECTOR_INDEX_MAX_DOCS:
+        return None
+    # Stream cursor batches into the preallocated float32 buffer
+    index = VectorIndex(capacity=count)
+    ids, vectors = [], []
+    for doc in collection.find(embedded, {"embedding": 1}).batch_size(VECTOR_INDEX_LOAD_BATCH):
+        ids.append(doc["_id"])
+        vectors.append(doc["embedding"])
+        if len(ids) >= VECTOR_INDEX_LOAD_BATCH:
+            index.add(ids, vectors)
+            ids, vectors = [], []
+    index.add(ids, vectors)
+    return index
+
+async def _refresh_vector_index(collection):
+    """Rebuild ``collection``'s index off the event loop, then swap it in"""
+    name = collection.name
+    pending = _vector_index_pending.setdefault(name, [])
+    try:
+        index = await asyncio.to_thread(_load_vector_index, collection)
+    except Exception as e:
+        print(f"Error loading in-process vector index: {e}")
+        # Keep serving the previous index until the next refresh
+        previous = _vector_indexes.get(name)
+        index = previous[1] if previous else None
+    else:
+        if index is not None:
+            for ids, vectors in pending:
+                index.add(ids, vectors)
+    finally:
+        _vector_index_pending.pop(name, None)
+    _vector_indexes[name] = (time.monotonic(), index)
+
+async def _get_vector_index(collection) -> Optional[VectorIndex]:
+    """Cached in-process index for ``collection``; loads on first use, refreshes in the background"""
+    name = collection.name
+    entry = _vector_indexes.get(name)
+    if entry is None:
+        async with _vector_index_lock:
+            if _vector_indexes.get(name) is None:
+                await _refresh_vector_index(collection)
+            entry = _vector_indexes.get(name)
+    elif time.monotonic() - entry[0] > VECTOR_INDEX_TTL and name not in _vector_index_pending:
+        _vector_index_pending[name] = []
+        task = asyncio.create_task(_refresh_vector_index(collection))
+        _vector_index_tasks.add(task)
+        task.add_done_callback(_vector_index_tasks.discard)
+    return entry[1] if entry else None
+
+def _update_vector_index(collection_name: str, ids: List, vectors: List):
+    """Keep a loaded in-process index in step with local writes"""
+    pending = _vector_index_pending.get(collection_name)
+    if pending is not None:
+        pending.append((ids, vectors))
+    entry = _vector_indexes.get(collection_name)
+    if entry and entry[1] is not None:
+        entry[1].add(ids, vectors)
+
+def _invalidate_search_caches():
+    """Drop cached search results after writes that change the bug collection"""
+    _exact_search_cache.clear()
+    _semantic_search_caches.clear()
+    _locality_pools.clear()
 
 def format_bug_for_rag(bug: BugRAGItem) -> str:
     """Format bug information for RAG processing"""
-    content_parts = [
-        f"Bug Name: {bug.name}",
-        f"Description: {bug.description}",
-        f"Type: {bug.type}",
-        f"Severity: {bug.severity}",
-        f"Status: {bug.status}"
-    ]
-    
-    if bug.file_path:
-        content_parts.append(f"File: {bug.file_path}")
-    
-    if bug.line_number:
-        content_parts.append(f"Line: {bug.line_number}")
-    
-    if bug.code_snippet:
-        content_parts.append(f"Code Snippet:\n{bug.code_snippet}")
-    
-    if bug.labels:
-        content_parts.append(f"Labels: {', '.join(bug.labels)}")
-    
-    if bug.project:
-        content_parts.append(f"Project: {bug.project}")
-    
-    if bug.component:
-        content_parts.append(f"Component: {bug.component}")
-    
-    return "\n".join(content_parts)
+    return (
+        f"Bug Name: {bug.name}\nDescription: {bug.description}\nType: {bug.type}\n"
+        f"Severity: {bug.severity}\nStatus: {bug.status}"
+        + (f"\nFile: {bug.file_path}" if bug.file_path else "")
+        + (f"\nLine: {bug.line_number}" if bug.line_number else "")
+        + (f"\nCode Snippet:\n{bug.code_snippet}" if bug.code_snippet else "")
+        + ("\nLabels: " + ", ".join(bug.labels) if bug.labels else "")
+        + (f"\nProject: {bug.project}" if bug.project else "")
+        + (f"\nComponent: {bug.component}" if bug.component else "")
+    )
 
-def create_bug_rag_metadata(bug: BugRAGItem) -> Dict[str, Any]:
-    """Create metadata for bug RAG document"""
+def create_bug_rag_metadata(bug: BugRAGItem, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Create metadata for bug RAG document; pass ``now`` to share one timestamp across a batch"""
     metadata = {
         "bug_name": bug.name,
         "bug_type": bug.type,
         "severity": bug.severity,
         "status": bug.status,
         "labels": bug.labels,
-        "created_at": datetime.utcnow(),
+        "created_at": now or datetime.utcnow(),
         "document_type": "bug_rag"
     }
     
@@ -149,19 +465,69 @@ def create_bug_rag_metadata(bug: BugRAGItem) -> Dict[str, Any]:
     
     return metadata
 
-def convert_objectid_to_str(obj):
-    """Convert ObjectId to string for JSON serialization"""
+def _mongo_default(obj):
+    """orjson fallback for BSON types; datetimes are serialized natively"""
     if isinstance(obj, ObjectId):
         return str(obj)
-    elif isinstance(obj, datetime):
-        return obj.isoformat()
-    elif isinstance(obj, dict):
-        return {key: convert_objectid_to_str(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_objectid_to_str(item) for item in obj]
-    return obj
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+# Stored for search only; responses never need them
+INTERNAL_FIELDS = ("embedding", "content_lower")
+INTERNAL_FIELDS_PROJECTION = {field: 0 for field in INTERNAL_FIELDS}
+
+def _without_embedding(docs: List[Dict]) -> List[Dict]:
+    """Copies of ``docs`` without the embedding vector and other search-only fields"""
+    return [{key: value for key, value in doc.items() if key not in INTERNAL_FIELDS} for doc in docs]
+
+def _search_response(request: "BugSearchRequest", results: List[Dict], search_type: Optional[str] = None) -> Response:
+    """Serialize search results (raw BSON docs) in one C-level orjson pass"""
+    payload = {
+        "query": request.query,
+        "results": results,
+        "total_found": len(results),
+        "collection": request.collection_name
+    }
+    if search_type:
+        payload["search_type"] = search_type
+    return Response(
+        content=orjson.dumps(payload, default=_mongo_default),
+        media_type="application/json"
+    )
 
 # API Endpoints
+async def _resolve_upserts(collection, target, operations, upsert_ops, doc_ids) -> set:
+    """Run the import bulk write and point doc_ids at the documents actually stored.
+
+    A concurrent import may insert the same content hash between our lookup and
+    the write; that upsert then matches the other document (or hits the unique
+    index), so its hash is returned as "lost" and its real _id is read back.
+    """
+    try:
+        result = await asyncio.to_thread(target.bulk_write, operations, ordered=False)
+        if not result.acknowledged:
+            # fast_insert (w=0): nothing to read back, ids stay client-generated
+            return set()
+        upserted = result.upserted_ids
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 or err.get("index") not in upsert_ops for err in errors):
+            raise
+        upserted = {item["index"]: item["_id"] for item in e.details.get("upserted", [])}
+    
+    lost = set()
+    for index, h in upsert_ops.items():
+        if index in upserted:
+            doc_ids[h] = upserted[index]
+        else:
+            lost.add(h)
+    if lost:
+        stored = await asyncio.to_thread(
+            lambda: list(collection.find({"content_hash": {"$in": list(lost)}}, {"content_hash": 1}))
+        )
+        for doc in stored:
+            doc_ids[doc["content_hash"]] = doc["_id"]
+    return lost
+
 @app.post("/rag-bugs/import")
 async def import_bugs_as_rag(request: BugRAGImportRequest):
     """Import bugs as RAG documents into MongoDB"""
@@ -171,41 +537,106 @@ async def import_bugs_as_rag(request: BugRAGImportRequest):
         
         imported_bugs = []
         
-        for bug in request.bugs:
-            # Format bug content for RAG
-            content = format_bug_for_rag(bug)
-            
-            # Generate embedding if requested
-            embedding = None
-            if request.generate_embeddings:
-                embedding = generate_gemini_embedding(content)
-            
-            # Create metadata
-            metadata = create_bug_rag_metadata(bug)
-            
-            # Create document
-            document = {
-                "content": content,
-                "metadata": metadata,
-                "embedding": embedding,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            
-            # Insert into MongoDB
-            result = collection.insert_one(document)
+        # Format bug content for RAG and hash it to find already-imported bugs
+        contents = [format_bug_for_rag(bug) for bug in request.bugs]
+        hashes = [content_hash(content) for content in contents]
+        unique_hashes = list(dict.fromkeys(hashes))
+        first_index = {}
+        for i, h in enumerate(hashes):
+            first_index.setdefault(h, i)
+        
+        await asyncio.to_thread(_ensure_content_hash_index, collection)
+        existing = {
+            doc["content_hash"]: doc
+            for doc in await asyncio.to_thread(
+                lambda: list(collection.find(
+                    {"content_hash": {"$in": unique_hashes}},
+                    # Only whether a vector exists, not the vector itself
+                    {"content_hash": 1, "has_embedding": {"$eq": [{"$type": "$embedding"}, "array"]}}
+                ))
+            )
+        }
+        
+        # Only embed contents not stored yet (or stored without a vector)
+        to_embed = []
+        if request.generate_embeddings:
+            to_embed = [
+                h for h in unique_hashes
+                if h not in existing or not existing[h].get("has_embedding")
+            ]
+        embeddings = {}
+        if to_embed:
+            vectors = await generate_gemini_embeddings_batch([contents[first_index[h]] for h in to_embed])
+            embeddings = dict(zip(to_embed, vectors))
+        
+        now = datetime.utcnow()
+        doc_ids = {}
+        operations = []
+        upsert_ops = {}  # operation index -> content hash of a new document
+        for h in unique_hashes:
+            if h in existing:
+                doc_ids[h] = existing[h]["_id"]
+                update = {"updated_at": now}
+                if h in embeddings:
+                    update["embedding"] = embeddings[h]
+                operations.append(UpdateOne({"_id": doc_ids[h]}, {"$set": update}))
+                continue
             
+            # New content: upsert on the hash so concurrent re-imports stay unique
+            bug = request.bugs[first_index[h]]
+            doc_ids[h] = ObjectId()
+            upsert_ops[len(operations)] = h
+            operations.append(UpdateOne(
+                {"content_hash": h},
+                {"$setOnInsert": {
+                    "_id": doc_ids[h],
+                    "content": contents[first_index[h]],
+                    "content_hash": h,
+                    "content_lower": contents[first_index[h]].lower(),
+                    "metadata": create_bug_rag_metadata(bug, now),
+                    "embedding": embeddings.get(h),
+                    "created_at": now,
+                    "updated_at": now
+                }},
+                upsert=True
+            ))
+        
+        # Write all documents in one round trip
+        if operations:
+            target = collection
+            if request.fast_insert:
+                # Fire-and-forget: no write acknowledgement from the server
+                target = collection.with_options(write_concern=WriteConcern(w=0))
+            lost = await _resolve_upserts(collection, target, operations, upsert_ops, doc_ids)
+            _invalidate_search_caches()
+            written = [h for h in embeddings if h not in lost]
+            _update_vector_index(
+                collection.name,
+                [doc_ids[h] for h in written],
+                [embeddings[h] for h in written]
+            )
+        else:
+            lost = set()
+        
+        for i, (bug, h) in enumerate(zip(request.bugs, hashes)):
+            if h in existing or h in lost:
+                status = "unchanged"
+            elif first_index[h] != i:
+                status = "duplicate"
+            else:
+                status = "imported"
             imported_bugs.append({
-                "bug_id": str(result.inserted_id),
+                "bug_id": str(doc_ids[h]),
                 "bug_name": bug.name,
-                "status": "imported"
+                "status": status
             })
         
         return {
             "message": f"Successfully imported {len(imported_bugs)} bugs as RAG documents",
             "collection": request.collection_name,
             "imported_bugs": imported_bugs,
-            "total_imported": len(imported_bugs)
+            "total_imported": len(imported_bugs),
+            "total_new": sum(1 for item in imported_bugs if item["status"] == "imported")
         }
     
     except Exception as e:
@@ -214,45 +645,100 @@ async def import_bugs_as_rag(request: BugRAGImportRequest):
 @app.post("/rag-bugs/search")
 async def search_bugs_in_rag(request: BugSearchRequest):
     """Search for bugs in RAG collection"""
+    query_embedding = None
     try:
+        if _use_filter_only(request):
+            # Filters drive the result; no Gemini call or vector search needed
+            collection = get_mongo_manager().get_collection(request.collection_name)
+            match_filter = {f"metadata.{key}": value for key, value in request.filters.items()}
+            results = await asyncio.to_thread(
+                lambda: list(collection.find(match_filter, INTERNAL_FIELDS_PROJECTION).limit(request.top_k))
+            )
+            return _search_response(request, results, "filter")
+        
+        # Exact repeat of a recent query: no embedding, no vector search
+        exact_key = _exact_search_key(request)
+        cached_results = _exact_search_cache.get(exact_key)
+        if cached_results is not None:
+            return _search_response(request, cached_results)
+        
         mongo_manager = get_mongo_manager()
         collection = mongo_manager.get_collection(request.collection_name)
         
         # Generate query embedding
-        query_embedding = generate_gemini_embedding(request.query)
+        query_embedding = await generate_gemini_embedding_async(request.query)
+        if not any(query_embedding):
+            # Embedding failed (zero sentinel): cosine is undefined, go straight to text search
+            raise ValueError("Query embedding unavailable")
         
-        # Build search pipeline
-        pipeline = [
-            {
-                "$vectorSearch": {
-                    "index": "vector_index",
-                    "path": "embedding",
-                    "queryVector": query_embedding,
-                    "numCandidates": request.top_k * 10,
-                    "limit": request.top_k
-                }
-            }
-        ]
+        # Semantically equivalent recent query with the same filters: reuse its results
+        semantic_cache = _semantic_search_cache(_search_signature(request))
+        cached_results = semantic_cache.get(query_embedding)
+        if cached_results is not None:
+            _exact_search_cache[exact_key] = cached_results
+            return _search_response(request, cached_results)
         
-        # Add filters if provided
+        # Nearby recent query: re-rank its wider result pool locally
+        use_pool = request.top_k <= LOCALITY_POOL_SIZE
+        pool_cache = _locality_pool_cache(request)
+        pool = pool_cache.get(query_embedding) if use_pool else None
+        if pool is not None:
+            results = _rerank_locality_pool(pool, query_embedding, request.top_k)
+            _exact_search_cache[exact_key] = results
+            semantic_cache.put(query_embedding, results)
+            return _search_response(request, results)
+        
+        # Small collection, no filters: exact cosine over the in-process index,
+        # then hydrate the hits in one query
+        vector_index = None if request.filters else await _get_vector_index(collection)
+        if vector_index is not None and len(vector_index):
+            hits = vector_index.search(query_embedding, request.top_k)
+            hit_ids = [doc_id for doc_id, _ in hits]
+            docs = await asyncio.to_thread(
+                lambda: {doc["_id"]: doc for doc in collection.find({"_id": {"$in": hit_ids}}, INTERNAL_FIELDS_PROJECTION)}
+            )
+            results = [docs[doc_id] for doc_id in hit_ids if doc_id in docs]
+            _exact_search_cache[exact_key] = results
+            semantic_cache.put(query_embedding, results)
+            return _search_response(request, results)
+        
+        # Fetch a full pool when it can serve later nearby queries
+        limit = LOCALITY_POOL_SIZE if use_pool else request.top_k
+        
+        # Build search pipeline; filters are applied during the ANN traversal
+        # (pre-filter), so every returned hit matches. Filtered fields such as
+        # metadata.status / metadata.bug_type / metadata.severity must be
+        # declared as "filter" fields in the Atlas vector_index definition.
+        vector_search = {
+            "index": "vector_index",
+            "path": "embedding",
+            "queryVector": query_embedding,
+            "numCandidates": limit * 10,
+            "limit": limit
+        }
         if request.filters:
-            match_stage = {"$match": {}}
-            for key, value in request.filters.items():
-                match_stage["$match"][f"metadata.{key}"] = value
-            pipeline.append(match_stage)
+            vector_search["filter"] = {f"metadata.{key}": value for key, value in request.filters.items()}
+        # Vectors come back only when they seed a locality pool
+        pipeline = [
+            {"$vectorSearch": vector_search},
+            {"$project": {"content_lower": 0} if use_pool else INTERNAL_FIELDS_PROJECTION}
+        ]
         
         # Execute search
-        results = list(collection.aggregate(pipeline))
+        results = await asyncio.to_thread(lambda: list(collection.aggregate(pipeline)))
         
-        # Convert ObjectId to string
-        results = convert_objectid_to_str(results)
+        if use_pool:
+            pool = _build_locality_pool(results)
+            if pool is not None:
+                pool_cache.put(query_embedding, pool)
+            results = results[:request.top_k]
+        # Vectors were only needed for the pool; never send them back
+        results = _without_embedding(results)
         
-        return {
-            "query": request.query,
-            "results": results,
-            "total_found": len(results),
-            "collection": request.collection_name
-        }
+        _exact_search_cache[exact_key] = results
+        semantic_cache.put(query_embedding, results)
+        
+        return _search_response(request, results)
     
     except Exception as e:
         # Fallback to text search if vector search fails
@@ -260,42 +746,77 @@ async def search_bugs_in_rag(request: BugSearchRequest):
             mongo_manager = get_mongo_manager()
             collection = mongo_manager.get_collection(request.collection_name)
             
-            search_filter = {
-                "$or": [
-                    {"content": {"$regex": request.query, "$options": "i"}},
-                    {"metadata.bug_name": {"$regex": request.query, "$options": "i"}},
-                    {"metadata.description": {"$regex": request.query, "$options": "i"}}
-                ]
-            }
+            metadata_filter = {f"metadata.{key}": value for key, value in request.filters.items()}
             
-            # Add additional filters
-            for key, value in request.filters.items():
-                search_filter[f"metadata.{key}"] = value
+            # With a usable query embedding, over-fetch and rank matches by cosine
+            rank = query_embedding is not None and any(query_embedding)
+            limit = request.top_k * FALLBACK_CANDIDATE_FACTOR if rank else request.top_k
+            projection = {"score": {"$meta": "textScore"}, "content_lower": 0}
+            if not rank:
+                projection["embedding"] = 0
             
-            results = list(collection.find(search_filter).limit(request.top_k))
-            results = convert_objectid_to_str(results)
+            # Index-backed keyword search ranked by text score
+            await asyncio.to_thread(_ensure_text_index, collection)
+            try:
+                results = await asyncio.to_thread(
+                    lambda: list(
+                        collection.find({"$text": {"$search": request.query}, **metadata_filter}, projection)
+                        .sort([("score", {"$meta": "textScore"})])
+                        .limit(limit)
+                    )
+                )
+            except Exception as text_error:
+                print(f"Text search failed, using regex match: {text_error}")
+                results = []
             
-            return {
-                "query": request.query,
-                "results": results,
-                "total_found": len(results),
-                "collection": request.collection_name,
-                "search_type": "text_fallback"
-            }
+            if not results:
+                # Partial-word matches the text index cannot serve: case-sensitive regex on
+                # the pre-lowered content (covers bug name and description). Unanchored, so it
+                # can't seek a key range; Mongo scans the content_lower index keys instead of
+                # the documents, which is cheaper but still proportional to the collection
+                await asyncio.to_thread(_ensure_content_lower_index, collection)
+                search_filter = {
+                    "content_lower": {"$regex": re.escape(request.query.lower())},
+                    **metadata_filter
+                }
+                regex_projection = {"content_lower": 0} if rank else INTERNAL_FIELDS_PROJECTION
+                results = await asyncio.to_thread(
+                    lambda: list(collection.find(search_filter, regex_projection).limit(limit))
+                )
+            if rank:
+                pool = _build_locality_pool(results)
+                if pool is not None:
+                    results = _rerank_locality_pool(pool, query_embedding, request.top_k)
+            results = _without_embedding(results[:request.top_k])
+            
+            return _search_response(request, results, "text_fallback")
         except Exception as fallback_error:
             raise HTTPException(status_code=500, detail=f"Error searching bugs: {str(fallback_error)}")
 
+async def _refresh_bug_embedding(collection, bug_id: ObjectId, content: str):
+    """Re-embed fixed bug content after the response has been sent"""
+    try:
+        new_embedding = await generate_gemini_embedding_async(content)
+        if not any(new_embedding):
+            return
+        # Only write if the content has not changed again in the meantime
+        await asyncio.to_thread(
+            collection.update_one,
+            {"_id": bug_id, "content": content},
+            {"$set": {"embedding": new_embedding}}
+        )
+        _invalidate_search_caches()
+        _update_vector_index(collection.name, [bug_id], [new_embedding])
+    except Exception as e:
+        print(f"Error refreshing embedding for bug {bug_id}: {e}")
+
 @app.post("/rag-bugs/fix")
-async def fix_bug(request: BugFixRequest):
+async def fix_bug(request: BugFixRequest, background_tasks: BackgroundTasks):
     """Fix a bug and update its status in the collection"""
     try:
         mongo_manager = get_mongo_manager()
         collection = mongo_manager.get_collection("bug_rag_documents")
-        
-        # Find the bug
-        bug_doc = collection.find_one({"_id": ObjectId(request.bug_id)})
-        if not bug_doc:
-            raise HTTPException(status_code=404, detail="Bug not found")
+        bug_id = ObjectId(request.bug_id)
         
         # Create fix record
         fix_record = {
@@ -307,32 +828,36 @@ async def fix_bug(request: BugFixRequest):
             "fixed_at": datetime.utcnow()
         }
         
-        # Update bug document
-        update_data = {
-            "$set": {
-                "metadata.status": "FIXED",
-                "metadata.fix_record": fix_record,
-                "updated_at": datetime.utcnow()
-            }
+        # Update bug document (pipeline update so the content can be appended server-side;
+        # user-provided values go through $literal so "$" is never read as a field path)
+        update_fields = {
+            "metadata.status": "FIXED",
+            "metadata.fix_record": {"$literal": fix_record},
+            "updated_at": "$$NOW"
         }
         
         # Add fix information to content for better RAG retrieval
         if request.fixed_code:
             fix_content = f"\n\nFIX APPLIED:\nDescription: {request.fix_description}\nFixed Code:\n{request.fixed_code}"
-            update_data["$set"]["content"] = bug_doc["content"] + fix_content
-            
-            # Regenerate embedding with fix information
-            new_embedding = generate_gemini_embedding(update_data["$set"]["content"])
-            update_data["$set"]["embedding"] = new_embedding
-        
-        # Update the document
-        result = collection.update_one(
-            {"_id": ObjectId(request.bug_id)},
-            update_data
+            update_fields["content"] = {"$concat": ["$content", {"$literal": fix_content}]}
+            # Lowered in Python (Unicode-aware) to match the import path and the query
+            update_fields["content_lower"] = {"$concat": ["$content_lower", {"$literal": fix_content.lower()}]}
+        
+        # Mark FIXED and read back the new content in a single round trip
+        bug_doc = await asyncio.to_thread(
+            collection.find_one_and_update,
+            {"_id": bug_id},
+            [{"$set": update_fields}],
+            projection={"content": 1},
+            return_document=ReturnDocument.AFTER
         )
+        if not bug_doc:
+            raise HTTPException(status_code=404, detail="Bug not found")
+        _invalidate_search_caches()
         
-        if result.modified_count == 0:
-            raise HTTPException(status_code=500, detail="Failed to update bug")
+        # Regenerate embedding with fix information off the request path
+        if request.fixed_code:
+            background_tasks.add_task(_refresh_bug_embedding, collection, bug_id, bug_doc["content"])
         
         return {
             "message": "Bug fixed successfully",
@@ -346,15 +871,46 @@ async def fix_bug(request: BugFixRequest):
             raise HTTPException(status_code=404, detail=str(e))
         raise HTTPException(status_code=500, detail=f"Error fixing bug: {str(e)}")
 
+def _stream_fix_suggestion(prompt: str, meta: Dict[str, Any]):
+    """Server-sent events: metadata first, then Gemini text chunks as they arrive"""
+    yield b"data: " + orjson.dumps(meta) + b"\n\n"
+    try:
+        for chunk in _GEMINI_FLASH.generate_content([SUGGEST_FIX_INSTRUCTIONS, prompt], stream=True):
+            yield b"data: " + orjson.dumps({"text": chunk.text}) + b"\n\n"
+    except Exception as e:
+        yield b"data: " + orjson.dumps({"error": f"Error generating fix suggestion: {str(e)}"}) + b"\n\n"
+    yield b"data: [DONE]\n\n"
+
 @app.post("/rag-bugs/suggest-fix")
-async def suggest_bug_fix(request: BugFixSuggestionRequest):
+async def suggest_bug_fix(
+    request: BugFixSuggestionRequest,
+    stream: bool = Query(default=False, description="Stream the suggestion as server-sent events")
+):
     """Get AI-powered fix suggestions for a bug"""
     try:
         mongo_manager = get_mongo_manager()
         collection = mongo_manager.get_collection(request.collection_name)
         
-        # Find the bug
-        bug_doc = collection.find_one({"_id": ObjectId(request.bug_id)})
+        bug_id = ObjectId(request.bug_id)
+        
+        # Find the bug and, concurrently, speculatively fetch fixed bugs before its type is known
+        bug_task = asyncio.to_thread(
+            collection.find_one, {"_id": bug_id}, {"content": 1, "metadata.bug_type": 1}
+        )
+        if request.include_similar_fixes:
+            bug_doc, candidates = await asyncio.gather(
+                bug_task,
+                asyncio.to_thread(
+                    lambda: list(
+                        collection.find(
+                            {"metadata.status": "FIXED", "_id": {"$ne": bug_id}},
+                            SIMILAR_FIX_PROJECTION
+                        ).limit(SIMILAR_FIX_CANDIDATES)
+                    )
+                )
+            )
+        else:
+            bug_doc, candidates = await bug_task, []
         if not bug_doc:
             raise HTTPException(status_code=404, detail="Bug not found")
         
@@ -363,14 +919,21 @@ async def suggest_bug_fix(request: BugFixSuggestionRequest):
         # Find similar fixed bugs if requested
         similar_fixes = []
         if request.include_similar_fixes:
-            # Search for similar bugs that have been fixed
-            search_filter = {
-                "metadata.status": "FIXED",
-                "metadata.bug_type": bug_doc["metadata"].get("bug_type"),
-                "_id": {"$ne": ObjectId(request.bug_id)}
-            }
-            
-            similar_bugs = list(collection.find(search_filter).limit(3))
+            bug_type = bug_doc["metadata"].get("bug_type")
+            similar_bugs = [
+                candidate for candidate in candidates
+                if candidate["metadata"].get("bug_type") == bug_type
+            ][:3]
+            if len(similar_bugs) < 3 and len(candidates) == SIMILAR_FIX_CANDIDATES:
+                # Speculative window too narrow: run the exact query
+                search_filter = {
+                    "metadata.status": "FIXED",
+                    "metadata.bug_type": bug_type,
+                    "_id": {"$ne": bug_id}
+                }
+                similar_bugs = await asyncio.to_thread(
+                    lambda: list(collection.find(search_filter, SIMILAR_FIX_PROJECTION).limit(3))
+                )
             for similar_bug in similar_bugs:
                 if "fix_record" in similar_bug["metadata"]:
                     similar_fixes.append({
@@ -379,12 +942,8 @@ async def suggest_bug_fix(request: BugFixSuggestionRequest):
                         "fixed_code": similar_bug["metadata"]["fix_record"].get("fixed_code")
                     })
         
-        # Generate AI fix suggestion
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        
+        # Generate AI fix suggestion: static instructions first, then the bug
         prompt = f"""
-Analyze the following bug and provide fix suggestions:
-
 BUG INFORMATION:
 {bug_content}
 
@@ -398,19 +957,15 @@ BUG INFORMATION:
                 if fix['fixed_code']:
                     prompt += f"   Code: {fix['fixed_code']}\n"
         
-        prompt += """
-
-Please provide:
-1. Root cause analysis
-2. Recommended fix approach
-3. Code suggestions (if applicable)
-4. Potential risks or considerations
-5. Testing recommendations
-
-Format your response in a clear, structured manner.
-"""
+        if stream:
+            # First bytes go out as soon as Gemini produces the first chunk
+            meta = {"bug_id": request.bug_id, "similar_fixes": similar_fixes}
+            return StreamingResponse(
+                iterate_in_threadpool(_stream_fix_suggestion(prompt, meta)),
+                media_type="text/event-stream"
+            )
         
-        response = model.generate_content(prompt)
+        response = _GEMINI_FLASH.generate_content([SUGGEST_FIX_INSTRUCTIONS, prompt])
         
         return {
             "bug_id": request.bug_id,
@@ -431,36 +986,29 @@ async def get_rag_bug_stats():
     try:
         mongo_manager = get_mongo_manager()
         collection = mongo_manager.get_collection("bug_rag_documents")
+        await asyncio.to_thread(_ensure_stats_index, collection)
         
-        # Get total count
-        total_bugs = collection.count_documents({})
-        
-        # Get stats by status
-        status_pipeline = [
-            {"$group": {
-                "_id": "$metadata.status",
-                "count": {"$sum": 1}
-            }}
-        ]
-        status_stats = list(collection.aggregate(status_pipeline))
-        
-        # Get stats by type
-        type_pipeline = [
-            {"$group": {
-                "_id": "$metadata.bug_type",
-                "count": {"$sum": 1}
+        # One round trip / one scan for the total and all three breakdowns
+        pipeline = [
+            {"$project": {
+                "_id": 0,
+                "status": "$metadata.status",
+                "bug_type": "$metadata.bug_type",
+                "severity": "$metadata.severity"
+            }},
+            {"$facet": {
+                "total": [{"$count": "n"}],
+                "by_status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+                "by_type": [{"$group": {"_id": "$bug_type", "count": {"$sum": 1}}}],
+                "by_severity": [{"$group": {"_id": "$severity", "count": {"$sum": 1}}}]
             }}
         ]
-        type_stats = list(collection.aggregate(type_pipeline))
+        facet = await asyncio.to_thread(lambda: next(collection.aggregate(pipeline), {}))
         
-        # Get stats by severity
-        severity_pipeline = [
-            {"$group": {
-                "_id": "$metadata.severity",
-                "count": {"$sum": 1}
-            }}
-        ]
-        severity_stats = list(collection.aggregate(severity_pipeline))
+        total_bugs = facet["total"][0]["n"] if facet.get("total") else 0
+        status_stats = facet.get("by_status", [])
+        type_stats = facet.get("by_type", [])
+        severity_stats = facet.get("by_severity", [])
         
         return {
             "total_bugs": total_bugs,
@@ -1,34 +1,60 @@
 import os
 import asyncio
+import functools
+import threading
+import time
+import hashlib
+import heapq
+from itertools import chain
 from typing import List, Dict, Any, Union, Optional
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 import google.generativeai as genai
 from dotenv import load_dotenv
 import numpy as np
+from cachetools import TTLCache
 from modules.mongodb_service import MongoDBManager
+from modules.embed_cache import SemanticCache
 import uvicorn
 
 # Load environment variables from root directory
 root_env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.env')
-load_dotenv(root_env_path)
+
+@functools.lru_cache(maxsize=1)
+def _load_env():
+    load_dotenv(root_env_path)
 
 # Resources initialized on startup
 embedding_model = None
 llm_model = None
 mongo_manager: Optional[MongoDBManager] = None
+_init_lock = threading.Lock()
+
+# Cache embedding theo sha256 của text, và câu trả lời theo độ tương đồng của query embedding
+EMBEDDING_CACHE_TTL = 3600
+embedding_cache = TTLCache(maxsize=4096, ttl=EMBEDDING_CACHE_TTL)
+search_response_cache = SemanticCache(threshold=0.97, maxsize=512, ttl_seconds=EMBEDDING_CACHE_TTL)
 
 def init_resources():
     global embedding_model, llm_model, mongo_manager
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if embedding_model is None or llm_model is None:
-        if not gemini_api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables")
-        genai.configure(api_key=gemini_api_key)
-        embedding_model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        llm_model = genai.GenerativeModel('gemini-2.0-flash-exp')
-    if mongo_manager is None:
-        mongo_manager = MongoDBManager()
+    if embedding_model is not None and llm_model is not None and mongo_manager is not None:
+        return
+    with _init_lock:
+        _load_env()
+        if embedding_model is None or llm_model is None:
+            gemini_api_key = os.getenv("GEMINI_API_KEY")
+            if not gemini_api_key:
+                raise ValueError("GEMINI_API_KEY not found in environment variables")
+            genai.configure(api_key=gemini_api_key)
+            embedding_model = genai.GenerativeModel('gemini-2.0-flash-exp')
+            llm_model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        if mongo_manager is None:
+            mongo_manager = MongoDBManager()
+
+# Kết quả /health gần nhất (giây)
+_PING_TTL = 5
+_last_ping_ts = 0.0
+_last_health: Optional[Dict[str, Any]] = None
 
 # APIRouter
 app = APIRouter()
@@ -56,6 +82,13 @@ class DocumentInput(BaseModel):
         }
     )
 
+class DocumentBatchInput(BaseModel):
+    docs: List[DocumentInput] = Field(
+        ...,
+        description="Danh sách documents cần thêm vào knowledge base",
+        min_length=1
+    )
+
 class SearchInput(BaseModel):
     query: Union[str, List[str]] = Field(
         ..., 
@@ -76,6 +109,10 @@ class SearchInput(BaseModel):
         description="Cách kết hợp multiple queries: 'OR' (tìm documents khớp BẤT KỲ query nào) hoặc 'AND' (tìm documents khớp TẤT CẢ queries)",
         pattern="^(OR|AND)$"
     )
+    use_cache: bool = Field(
+        default=True,
+        description="Dùng cache embedding/câu trả lời cho các query lặp lại hoặc gần giống nhau"
+    )
 
 class SearchResponse(BaseModel):
     answer: str = Field(
@@ -100,28 +137,77 @@ class SearchResponse(BaseModel):
         example="Python performance optimization"
     )
 
+# Số text tối đa trong một lần gọi batch embed của Gemini
+EMBED_BATCH_SIZE = 100
+
+# Độ dài preview nội dung document trong sources
+SOURCE_PREVIEW_CHARS = 200
+
+# Giới hạn context gửi cho Gemini (~4 ký tự / token)
+CONTEXT_DOC_MAX_CHARS = 1500
+CONTEXT_MAX_CHARS = 16000
+
 # Helper functions
-async def get_gemini_embedding(text: str) -> List[float]:
+def _embed_texts_sync(texts: List[str]) -> List[List[float]]:
+    """One Gemini embed_content call for a list of texts (blocking)"""
+    result = genai.embed_content(
+        model="models/text-embedding-004",
+        content=texts,
+        task_type="retrieval_document"
+    )
+    return result['embedding']
+
+def _embedding_cache_key(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+async def get_gemini_embeddings(texts: List[str], use_cache: bool = True) -> List[List[float]]:
+    """Get embeddings for many texts from Gemini in a single round trip; cached texts are skipped"""
+    keys = [_embedding_cache_key(text) for text in texts]
+    embeddings = [embedding_cache.get(key) if use_cache else None for key in keys]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        try:
+            computed = await asyncio.to_thread(_embed_texts_sync, [texts[i] for i in missing])
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error generating embedding: {str(e)}")
+        for i, embedding in zip(missing, computed):
+            embeddings[i] = embedding
+            embedding_cache[keys[i]] = embedding
+    return embeddings
+
+async def get_gemini_embedding(text: str, use_cache: bool = True) -> List[float]:
     """Get embedding from Gemini Flash 2.0"""
-    try:
-        # Use Gemini's embedding task
-        result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=text,
-            task_type="retrieval_document"
-        )
-        return result['embedding']
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating embedding: {str(e)}")
+    return (await get_gemini_embeddings([text], use_cache))[0]
+
+def _doc_key(doc: Dict) -> str:
+    """Document identity across per-query result lists (search_by_embedding returns doc_id)"""
+    return str(doc.get("doc_id", doc.get("_id", id(doc))))
+
+def _doc_score(doc: Dict) -> float:
+    return doc.get("similarity_score", doc.get("similarity", 0))
+
+def _format_source(doc: Dict) -> Dict[str, Any]:
+    content = doc["content"]
+    return {
+        "content": content if len(content) <= SOURCE_PREVIEW_CHARS else f"{content[:SOURCE_PREVIEW_CHARS]}…",
+        "metadata": doc.get("metadata", {}),
+        "similarity_score": _doc_score(doc)
+    }
 
 async def generate_answer_with_gemini(query: str, context_docs: List[Dict]) -> str:
     """Generate answer using Gemini Flash 2.0"""
     try:
-        # Prepare context from retrieved documents
-        context = "\n\n".join([
-            f"Document {i+1}: {doc.get('content', '')}" 
-            for i, doc in enumerate(context_docs)
-        ])
+        # Prepare context from retrieved documents: each one truncated, stop at the budget
+        buf = []
+        append = buf.append
+        used = 0
+        for i, doc in enumerate(context_docs):
+            part = f"Document {i+1}: {doc.get('content', '')[:CONTEXT_DOC_MAX_CHARS]}\n\n"
+            if buf and used + len(part) > CONTEXT_MAX_CHARS:
+                break
+            append(part)
+            used += len(part)
+        context = "".join(buf)
         
         prompt = f"""
 Bạn là một AI assistant thông minh. Dựa trên thông tin được cung cấp, hãy trả lời câu hỏi một cách chính xác và chi tiết.
@@ -155,6 +241,7 @@ async def root():
         ],
         "endpoints": {
             "add_document": "POST /reasoning/add",
+            "add_documents_batch": "POST /reasoning/add_batch",
             "search": "POST /reasoning/search",
             "stats": "GET /reasoning/stats"
         }
@@ -162,12 +249,19 @@ async def root():
 
 @app.get("/health")
 async def health_check():
+    global _last_ping_ts, _last_health
+    # Liveness probes hit this every few seconds; reuse a recent ping result
+    now = time.monotonic()
+    if _last_health is not None and now - _last_ping_ts < _PING_TTL:
+        return _last_health
     try:
         # Test MongoDB connection
-        mongo_manager.client.admin.command('ping')
-        return {"status": "healthy", "database": "connected", "ai_model": "gemini-2.0-flash-exp"}
+        await asyncio.to_thread(mongo_manager.client.admin.command, 'ping')
+        health = {"status": "healthy", "database": "connected", "ai_model": "gemini-2.0-flash-exp"}
     except Exception as e:
-        return {"status": "unhealthy", "error": str(e)}
+        health = {"status": "unhealthy", "error": str(e)}
+    _last_ping_ts, _last_health = now, health
+    return health
 
 @app.post("/reasoning/add")
 async def add_document(doc_input: DocumentInput):
@@ -183,6 +277,8 @@ async def add_document(doc_input: DocumentInput):
             metadata=doc_input.metadata
         )
         
+        search_response_cache.clear()
+        
         return {
             "message": "Document added successfully",
             "document_id": str(doc_id),
@@ -192,6 +288,42 @@ async def add_document(doc_input: DocumentInput):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding document: {str(e)}")
 
+@app.post("/reasoning/add_batch")
+async def add_documents_batch(batch: DocumentBatchInput):
+    """Add many documents with batched Gemini embeddings and one bulk MongoDB insert"""
+    try:
+        texts = [doc.content for doc in batch.docs]
+        
+        # Group similar lengths into the same embed call, then restore input order
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        chunks = [order[start:start + EMBED_BATCH_SIZE] for start in range(0, len(order), EMBED_BATCH_SIZE)]
+        chunk_embeddings = await asyncio.gather(*(
+            get_gemini_embeddings([texts[i] for i in chunk]) for chunk in chunks
+        ))
+        embeddings = [None] * len(texts)
+        for chunk, vectors in zip(chunks, chunk_embeddings):
+            for i, vector in zip(chunk, vectors):
+                embeddings[i] = vector
+        
+        doc_ids, errors = await asyncio.to_thread(
+            mongo_manager.bulk_add_documents,
+            texts,
+            embeddings,
+            [doc.metadata for doc in batch.docs]
+        )
+        search_response_cache.clear()
+        
+        return {
+            "message": f"Added {len(texts) - len(errors)}/{len(texts)} documents",
+            "document_ids": doc_ids,
+            "errors": {str(i): message for i, message in errors.items()},
+            "embedding_model": "gemini-2.0-flash-exp"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error adding documents: {str(e)}")
+
 @app.post("/reasoning/search", response_model=SearchResponse)
 async def search_documents(search_input: SearchInput):
     """
@@ -235,55 +367,69 @@ async def search_documents(search_input: SearchInput):
         if isinstance(search_input.query, str):
             # Single query
             query_text = search_input.query
-            query_embedding = await get_gemini_embedding(query_text)
+            query_embedding = await get_gemini_embedding(query_text, search_input.use_cache)
+            
+            # Câu hỏi gần giống một câu đã trả lời (cùng limit): dùng lại kết quả,
+            # nhưng trả về đúng câu hỏi của người dùng hiện tại
+            if search_input.use_cache:
+                cached = search_response_cache.get(query_embedding, key=search_input.limit)
+                if cached is not None:
+                    return cached.model_copy(update={"query": query_text})
             
-            results = mongo_manager.search_by_embedding(
+            results = await asyncio.to_thread(
+                mongo_manager.search_by_embedding,
                 query_embedding=query_embedding,
                 top_k=search_input.limit
             )
         else:
             # Multiple queries (array)
             query_text = " ".join(search_input.query)  # Combine for answer generation
-            all_results = []
             
-            for single_query in search_input.query:
-                query_embedding = await get_gemini_embedding(single_query)
-                single_results = mongo_manager.search_by_embedding(
+            # Repeated keywords (case/whitespace aside) are embedded and searched once
+            unique_queries = list(dict.fromkeys(q.strip().lower() for q in search_input.query if q.strip()))
+            
+            # All query embeddings in one Gemini call, then the searches concurrently
+            query_embeddings = (
+                await get_gemini_embeddings(unique_queries, search_input.use_cache)
+                if unique_queries else []
+            )
+            results_per_query = await asyncio.gather(*(
+                asyncio.to_thread(
+                    mongo_manager.search_by_embedding,
                     query_embedding=query_embedding,
                     top_k=search_input.limit
                 )
-                all_results.extend(single_results)
+                for query_embedding in query_embeddings
+            ))
+            all_results = list(chain.from_iterable(results_per_query))
             
             # Remove duplicates and combine results based on mode
             if search_input.combine_mode.upper() == "AND":
-                # For AND mode, only keep documents that appear in all query results
-                doc_counts = {}
-                for doc in all_results:
-                    doc_id = doc.get("_id", str(doc))
-                    if doc_id not in doc_counts:
-                        doc_counts[doc_id] = {"count": 0, "doc": doc, "total_score": 0}
-                    doc_counts[doc_id]["count"] += 1
-                    doc_counts[doc_id]["total_score"] += doc.get("similarity_score", 0)
-                
-                # Only keep docs that appear in all queries
-                num_queries = len(search_input.query)
-                results = [
-                    {**item["doc"], "similarity_score": item["total_score"] / item["count"]}
-                    for item in doc_counts.values() 
-                    if item["count"] == num_queries
-                ]
+                # For AND mode, only keep documents that appear in all query results:
+                # group by document id and average the scores in one vectorized pass
+                num_queries = len(unique_queries)
+                results = []
+                if all_results:
+                    keys = np.array([_doc_key(doc) for doc in all_results], dtype=object)
+                    scores = np.fromiter((_doc_score(doc) for doc in all_results), dtype=np.float32, count=len(all_results))
+                    _, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+                    sums = np.bincount(inverse, weights=scores)
+                    results = [
+                        {**all_results[first[i]], "similarity_score": float(sums[i] / counts[i])}
+                        for i in np.flatnonzero(counts == num_queries)
+                    ]
             else:
                 # For OR mode (default), combine all results and remove duplicates
                 seen_docs = set()
                 results = []
                 for doc in all_results:
-                    doc_id = doc.get("_id", str(doc))
+                    doc_id = _doc_key(doc)
                     if doc_id not in seen_docs:
                         seen_docs.add(doc_id)
                         results.append(doc)
             
-            # Sort by similarity score and limit
-            results = sorted(results, key=lambda x: x.get("similarity_score", 0), reverse=True)[:search_input.limit]
+            # Top `limit` by similarity score without sorting the whole merged list
+            results = heapq.nlargest(search_input.limit, results, key=_doc_score)
         
         if not results:
             return SearchResponse(
@@ -296,20 +442,16 @@ async def search_documents(search_input: SearchInput):
         answer = await generate_answer_with_gemini(query_text, results)
         
         # Format sources
-        sources = [
-            {
-                "content": doc["content"][:200] + "..." if len(doc["content"]) > 200 else doc["content"],
-                "metadata": doc.get("metadata", {}),
-                "similarity_score": doc.get("similarity_score", 0)
-            }
-            for doc in results
-        ]
+        sources = [_format_source(doc) for doc in results]
         
-        return SearchResponse(
+        response = SearchResponse(
             answer=answer,
             sources=sources,
             query=query_text
         )
+        if isinstance(search_input.query, str) and search_input.use_cache:
+            search_response_cache.put(query_embedding, response, key=search_input.limit)
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during search: {str(e)}")
 
@@ -335,6 +477,7 @@ async def delete_document(doc_id: str):
     try:
         success = mongo_manager.delete_document(doc_id)
         if success:
+            search_response_cache.clear()
             return {"message": "Document deleted successfully", "document_id": doc_id}
         else:
             raise HTTPException(status_code=404, detail="Document not found")
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
-import json
 import sys
 import os
 
+import orjson
+
 # Add the project root to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
@@ -19,16 +20,15 @@ def debug_bearer_conversion():
         print(f"Reading file: {bearer_file}")
         print(f"File exists: {os.path.exists(bearer_file)}")
         
-        # Read file content first
-        with open(bearer_file, 'r', encoding='utf-8') as f:
-            file_content = f.read()
-            print(f"File size: {len(file_content)} chars")
-            print(f"File content (first 200 chars): {repr(file_content[:200])}")
-            
+        # Read once as bytes; orjson parses UTF-8 bytes directly
+        with open(bearer_file, 'rb') as f:
+            raw = f.read()
+        print(f"File size: {len(raw)} bytes")
+        print(f"File content (first 200 chars): {repr(raw[:200].decode('utf-8', errors='replace'))}")
+        
         # Parse JSON
-        with open(bearer_file, 'r', encoding='utf-8') as f:
-            bearer_data = json.load(f)
-            print(f"JSON loaded successfully, type: {type(bearer_data)}")
+        bearer_data = orjson.loads(raw)
+        print(f"JSON loaded successfully, type: {type(bearer_data)}")
         
         print(f"Bearer data keys: {list(bearer_data.keys())}")
         
@@ -4,16 +4,17 @@ One-time Serena Toolkit Installation Script
 Clones Serena from GitHub and installs required dependencies
 """
 
+import datetime
 import os
 import subprocess
 import sys
 from pathlib import Path
 
 def run_command(cmd, cwd=None, check=True):
-    """Run shell command with error handling"""
-    print(f"Running: {cmd}")
+    """Run a command (argument list, no shell) with error handling"""
+    print(f"Running: {' '.join(cmd)}")
     try:
-        result = subprocess.run(cmd, shell=True, cwd=cwd, check=check, 
+        result = subprocess.run(cmd, shell=False, cwd=cwd, check=check, 
                               capture_output=True, text=True)
         if result.stdout:
             print(result.stdout)
@@ -23,6 +24,9 @@ def run_command(cmd, cwd=None, check=True):
         if e.stderr:
             print(f"Error output: {e.stderr}")
         return False
+    except FileNotFoundError as e:
+        print(f"Error running command: {e}")
+        return False
 
 def install_serena():
     """Install Serena toolkit"""
@@ -59,7 +63,7 @@ def install_serena():
         import shutil
         shutil.rmtree(serena_dir)
     
-    clone_cmd = "git clone https://github.com/hieuvd341/serena.git"
+    clone_cmd = ["git", "clone", "https://github.com/hieuvd341/serena.git"]
     if not run_command(clone_cmd, cwd=projects_dir):
         print("❌ Failed to clone Serena repository")
         return False
@@ -80,22 +84,22 @@ def install_serena():
         "tree-sitter-c>=0.20.0"
     ]
     
-    for dep in deps:
-        if not run_command(f"pip install {dep}"):
-            print(f"⚠ Warning: Failed to install {dep}")
+    # One pip invocation so the resolver runs once for all parsers
+    if not run_command(["pip", "install", *deps]):
+        print(f"⚠ Warning: Failed to install some of: {', '.join(deps)}")
     
     # Install additional requirements if requirements.txt exists
     requirements_file = os.path.join(serena_dir, "requirements.txt")
     if os.path.exists(requirements_file):
         print("Installing from requirements.txt...")
-        if not run_command(f"pip install -r {requirements_file}"):
+        if not run_command(["pip", "install", "-r", requirements_file]):
             print("⚠ Warning: Failed to install some requirements")
     
     # Create marker file
     print("\n3. Creating installation marker...")
     with open(marker_file, 'w') as f:
         f.write(f"Serena installed at: {serena_dir}\n")
-        f.write(f"Installation date: {subprocess.check_output(['date']).decode().strip()}\n")
+        f.write(f"Installation date: {datetime.datetime.now().isoformat()}\n")
     
     print("✓ Installation marker created")
     
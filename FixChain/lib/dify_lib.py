@@ -1,10 +1,22 @@
-import requests
+import asyncio
+import functools
+import logging
+import weakref
+
+import httpx
 from utils.logger import logger
 from enum import Enum
 
 DIFY_BASE_URL = "https://api.dify.ai/v1"
 DIFY_BASE_URL_LOCAL = "http://localhost:5001/v1"
 
+DIFY_TIMEOUT = httpx.Timeout(30, connect=10)
+DIFY_WORKFLOW_TIMEOUT = httpx.Timeout(180, connect=10)
+DIFY_LIMITS = httpx.Limits(max_keepalive_connections=32)
+
+# One keep-alive HTTP/2 client per event loop; concurrent Dify calls share its sockets
+_dify_clients = weakref.WeakKeyDictionary()
+
 
 class DifyMode(Enum):
     CLOUD = "CLOUD"
@@ -16,21 +28,70 @@ def get_dify_base_url(mode):
     return DIFY_BASE_URL
 
 
-def get_headers(api_key):
+def get_dify_client():
+    """Shared httpx.AsyncClient for the running event loop (closed by close_dify_client)"""
+    loop = asyncio.get_running_loop()
+    client = _dify_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(http2=True, timeout=DIFY_TIMEOUT, limits=DIFY_LIMITS)
+        _dify_clients[loop] = client
+    return client
+
+
+async def close_dify_client():
+    """Close the running loop's shared client; must run before that loop ends"""
+    client = _dify_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+def run_dify(coro):
+    """Run a Dify coroutine from sync code.
+
+    Like ``asyncio.run`` but the loop's shared client is closed before the loop
+    ends, so its sockets are released instead of leaking with the dead loop.
+    Sync callers that make several calls should wrap the whole sequence in one
+    coroutine so the client (and its keep-alive connections) is reused.
+    """
+    async def _main():
+        try:
+            return await coro
+        finally:
+            await close_dify_client()
+    return asyncio.run(_main())
+
+
+DIFY_LOG_BODY_CHARS = 512
+
+
+def log_response_body(label, response):
+    """Debug-only, truncated body log; reading .text decodes the whole body"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Dify %s response (truncated): %s", label, response.text[:DIFY_LOG_BODY_CHARS])
+
+
+@functools.lru_cache(maxsize=64)
+def log_api_key_once(api_key):
     masked = api_key[:6] + "..." if api_key else "None"
     logger.info(f"Generating Dify headers for api_key: {masked}")
-    return {"Authorization": f"Bearer {api_key}"}
 
 
-def fetch_info(api_key, mode=DifyMode.CLOUD):
+@functools.lru_cache(maxsize=64)
+def get_headers(api_key):
+    """Immutable header pairs per api_key (httpx accepts a sequence of pairs)"""
+    log_api_key_once(api_key)
+    return (("Authorization", f"Bearer {api_key}"),)
+
+
+async def fetch_info(api_key, mode=DifyMode.CLOUD):
     try:
         base_url = get_dify_base_url(mode)
-        resp = requests.get(
-            f"{base_url}/info", headers=get_headers(api_key), timeout=30
+        resp = await get_dify_client().get(
+            f"{base_url}/info", headers=get_headers(api_key)
         )
         resp.raise_for_status()
         return resp.json()
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error("Dify API request timed out (info endpoint).")
         raise
     except Exception as e:
@@ -38,15 +99,15 @@ def fetch_info(api_key, mode=DifyMode.CLOUD):
         raise
 
 
-def fetch_site(api_key, mode=DifyMode.CLOUD):
+async def fetch_site(api_key, mode=DifyMode.CLOUD):
     try:
         base_url = get_dify_base_url(mode)
-        resp = requests.get(
-            f"{base_url}/site", headers=get_headers(api_key), timeout=30
+        resp = await get_dify_client().get(
+            f"{base_url}/site", headers=get_headers(api_key)
         )
         resp.raise_for_status()
         return resp.json()
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error("Dify API request timed out (site endpoint).")
         raise
     except Exception as e:
@@ -54,15 +115,15 @@ def fetch_site(api_key, mode=DifyMode.CLOUD):
         raise
 
 
-def fetch_parameters(api_key, mode=DifyMode.CLOUD):
+async def fetch_parameters(api_key, mode=DifyMode.CLOUD):
     try:
         base_url = get_dify_base_url(mode)
-        resp = requests.get(
-            f"{base_url}/parameters", headers=get_headers(api_key), timeout=30
+        resp = await get_dify_client().get(
+            f"{base_url}/parameters", headers=get_headers(api_key)
         )
         resp.raise_for_status()
         return resp.json()
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error("Dify API request timed out (parameters endpoint).")
         raise
     except Exception as e:
@@ -70,7 +131,7 @@ def fetch_parameters(api_key, mode=DifyMode.CLOUD):
         raise
 
 
-def upload_document_to_dify(
+async def upload_document_to_dify(
     api_key, filepath, filename, mimetype, user, mode=DifyMode.CLOUD
 ):
     """Upload a document to Dify using the /upload endpoint and return the Dify document ID."""
@@ -79,16 +140,19 @@ def upload_document_to_dify(
         base_url = get_dify_base_url(mode)
         url = f"{base_url}/files/upload"
         headers = get_headers(api_key)
-        files = {"file": (filename, open(filepath, "rb"), mimetype)}
         data = {"user": user or "hieult", "type": "document"}
         logger.info(f"POST {url} with user={user} and type=document")
 
-        response = requests.post(
-            url, headers=headers, files=files, data=data, timeout=30
-        )
+        # httpx streams the multipart body from the open handle in chunks;
+        # the with-block closes it on success, error and timeout alike
+        with open(filepath, "rb") as fh:
+            files = {"file": (filename, fh, mimetype)}
+            response = await get_dify_client().post(
+                url, headers=headers, files=files, data=data
+            )
 
         logger.info(f"Dify upload response status: {response.status_code}")
-        logger.info(f"Dify upload response: {response.text}")
+        log_response_body("upload", response)
         response.raise_for_status()
         response_json = response.json()
         dify_document_id = response_json.get("id")
@@ -96,7 +160,7 @@ def upload_document_to_dify(
             logger.error(f"No 'id' field in Dify response: {response_json}")
             raise ValueError("Failed to get Dify document ID from upload response.")
         return dify_document_id
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error("Dify API request timed out (upload_document endpoint).")
         raise
     except Exception as e:
@@ -104,10 +168,10 @@ def upload_document_to_dify(
         raise
 
 
-def run_workflow_with_dify(api_key, inputs, user, response_mode, mode=DifyMode.CLOUD):
+async def run_workflow_with_dify(api_key, inputs, user, response_mode, mode=DifyMode.CLOUD):
     """Run a workflow via Dify API using the workflow's api_key."""
     try:
-        logger.info(f"Running workflow with Dify API: {api_key}")
+        logger.info("Running workflow with Dify API")
         logger.info(f"User: {user}")
         logger.info(f"Mode: {mode}")
 
@@ -115,15 +179,19 @@ def run_workflow_with_dify(api_key, inputs, user, response_mode, mode=DifyMode.C
         logger.info(f"Base URL: {base_url}")
         url = f"{base_url}/workflows/run"
         headers = get_headers(api_key)
-        headers["Content-Type"] = "application/json"
         payload = {"inputs": inputs, "user": user, "response_mode": response_mode}
-        logger.info(f"POST {url} with payload: {payload}")
-        response = requests.post(url, headers=headers, json=payload, timeout=(10, 180))
+        logger.info(f"POST {url}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Dify workflow payload (truncated): %s", str(payload)[:DIFY_LOG_BODY_CHARS])
+        # Blocking workflows can take minutes; awaiting keeps the event loop free
+        response = await get_dify_client().post(
+            url, headers=headers, json=payload, timeout=DIFY_WORKFLOW_TIMEOUT
+        )
         logger.info(f"Dify workflow run response status: {response.status_code}")
-        logger.info(f"Dify workflow run response: {response.text}")
+        log_response_body("workflow run", response)
         response.raise_for_status()
         return response.json()  # Trả về ngay sau khi gọi API
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error("Dify API request timed out (run_workflow endpoint).")
         raise
     except Exception as e:
@@ -131,19 +199,19 @@ def run_workflow_with_dify(api_key, inputs, user, response_mode, mode=DifyMode.C
         raise
 
 
-def get_workflow_logs(api_key, mode=DifyMode.CLOUD):
+async def get_workflow_logs(api_key, mode=DifyMode.CLOUD):
     """Get workflow logs from Dify API."""
     try:
         base_url = get_dify_base_url(mode)
         url = f"{base_url}/workflows/logs"
         headers = get_headers(api_key)
         logger.info(f"GET {url} for workflow logs")
-        response = requests.get(url, headers=headers, timeout=30)
+        response = await get_dify_client().get(url, headers=headers)
         logger.info(f"Dify logs response status: {response.status_code}")
-        logger.info(f"Dify logs response: {response.text}")
+        log_response_body("logs", response)
         response.raise_for_status()
         return response.json()
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error("Dify API request timed out (logs endpoint).")
         raise
     except Exception as e:
@@ -7,9 +7,11 @@ Integrated FastAPI with all controllers using APIRouter
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import os
 from dotenv import load_dotenv
 from utils.logger import logger
+from utils.gzip_middleware import StreamingAwareGZipMiddleware
 
 # Load environment variables from root directory
 root_env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env')
@@ -49,6 +51,7 @@ app = FastAPI(
     - **Embedding**: text-embedding-004
     """,
     version="2.0.0",
+    default_response_class=ORJSONResponse,
     contact={
         "name": "FixChain2 Team",
         "email": "support@fixchain2.com"
@@ -68,6 +71,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Nén các response lớn (kết quả search/analysis); SSE stream không nén
+app.add_middleware(StreamingAwareGZipMiddleware, minimum_size=1024)
+
 # Include routers with prefixes
 app.include_router(bug_controller.app, prefix="/api/v1/bugs", tags=["Bug Management"])
 app.include_router(rag_controller.app, prefix="/api/v1/rag", tags=["RAG System"])
@@ -1,9 +1,33 @@
 from __future__ import annotations
-import json
-from typing import Dict, List
+import copy
+import hashlib
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
 
+import orjson
 from utils.logger import logger
-from lib.dify_lib import DifyMode, run_workflow_with_dify
+from lib.dify_lib import DifyMode, run_dify, run_workflow_with_dify
+
+# Cache kết quả Dify theo nội dung (source + report + rag + mode)
+ANALYSIS_CACHE_MAXSIZE = 256
+ANALYSIS_CACHE_TTL = 3600  # seconds
+
+
+def serialize_report(bugs: List[Dict]) -> str:
+    """Encode a bug list for the Dify ``report`` input (UTF-8, non-ASCII kept as-is)"""
+    return orjson.dumps(bugs).decode("utf-8")
+
+
+def _count_fix(bugs_array: List) -> int:
+    """Number of bug entries whose ``action`` mentions FIX"""
+    return sum(
+        1
+        for bug in bugs_array
+        if isinstance(bug, dict)
+        and isinstance(action := bug.get("action"), str)
+        and "fix" in action.lower()
+    )
 
 
 class AnalysisService:
@@ -12,19 +36,49 @@ class AnalysisService:
     def __init__(self, dify_cloud_api_key: str | None = None, dify_local_api_key: str | None = None):
         self.dify_cloud_api_key = dify_cloud_api_key
         self.dify_local_api_key = dify_local_api_key
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+    @staticmethod
+    def _cache_key(source_code: str, report: str, use_rag: bool, mode: DifyMode) -> str:
+        h = hashlib.blake2b(digest_size=32)
+        h.update(source_code.encode("utf-8"))
+        h.update(b"|")
+        h.update(report.encode("utf-8"))
+        h.update(b"|" + bytes([bool(use_rag)]) + b"|" + str(mode).encode("utf-8"))
+        return h.hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[Dict]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if time.monotonic() - stored_at > ANALYSIS_CACHE_TTL:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return copy.deepcopy(result)
+
+    def _cache_put(self, key: str, result: Dict):
+        self._cache[key] = (time.monotonic(), copy.deepcopy(result))
+        self._cache.move_to_end(key)
+        while len(self._cache) > ANALYSIS_CACHE_MAXSIZE:
+            self._cache.popitem(last=False)
 
     def count_bug_types(self, bugs: List[Dict]) -> Dict[str, int]:
         counts: Dict[str, int] = {"BUG": 0, "CODE_SMELL": 0, "VULNERABILITY": 0}
-        for bug in bugs:
-            bug_type = bug.get("type", "UNKNOWN")
-            if bug_type in counts:
-                counts[bug_type] += 1
-            else:
-                counts[bug_type] = counts.get(bug_type, 0) + 1
+        counts.update(Counter(bug.get("type", "UNKNOWN") for bug in bugs))
         counts["TOTAL"] = len(bugs)
         return counts
 
-    def analyze_bugs_with_dify(self, bugs: List[Dict], use_rag: bool = False, mode: DifyMode = DifyMode.CLOUD, source_code: str = "") -> Dict:
+    def analyze_bugs_with_dify(self, bugs: List[Dict], use_rag: bool = False, mode: DifyMode = DifyMode.CLOUD, source_code: str = "", report_json: Optional[str] = None) -> Dict:
+        return run_dify(self.analyze_bugs_with_dify_async(bugs, use_rag=use_rag, mode=mode, source_code=source_code, report_json=report_json))
+
+    async def analyze_bugs_with_dify_async(self, bugs: List[Dict], use_rag: bool = False, mode: DifyMode = DifyMode.CLOUD, source_code: str = "", report_json: Optional[str] = None) -> Dict:
+        """Analyze bugs with Dify; await this from async code (the sync wrapper can't run inside a loop).
+
+        ``report_json`` lets the caller pass bugs already serialized with
+        ``serialize_report`` so the same list is not re-encoded per step.
+        """
         list_bugs = []
         bugs_to_fix = 0
         try:
@@ -35,10 +89,15 @@ class AnalysisService:
             inputs = {
                 "is_use_rag": str(use_rag),
                 "src": source_code,
-                "report": json.dumps(bugs, ensure_ascii=False),
+                "report": report_json if report_json is not None else serialize_report(bugs),
             }
+            cache_key = self._cache_key(source_code, inputs["report"], use_rag, mode)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                logger.info(f"DIFY: Reusing cached analysis for {len(bugs)} bugs")
+                return cached
             logger.info(f"Need to fix {len(bugs)} bugs using Dify")
-            response = run_workflow_with_dify(
+            response = await run_workflow_with_dify(
                 api_key=api_key,
                 inputs=inputs,
                 user="hieult",
@@ -61,42 +120,33 @@ class AnalysisService:
             if bugs_to_fix == 0 and isinstance(list_bugs, dict) and "bugs" in list_bugs:
                 bugs_array = list_bugs.get("bugs", [])
                 if isinstance(bugs_array, list):
-                    fix_count = sum(
-                        1
-                        for bug in bugs_array
-                        if isinstance(bug, dict)
-                        and "action" in bug
-                        and "FIX" in str(bug.get("action", "")).upper()
-                    )
+                    fix_count = _count_fix(bugs_array)
                     logger.info(
                         f"DIFY: Counted {fix_count} bugs with 'FIX' action from list of {len(bugs_array)} bugs"
                     )
                     bugs_to_fix = fix_count
             elif bugs_to_fix == 0 and isinstance(list_bugs, list):
-                fix_count = sum(
-                    1
-                    for bug in list_bugs
-                    if isinstance(bug, dict)
-                    and "action" in bug
-                    and "FIX" in str(bug.get("action", "")).upper()
-                )
+                fix_count = _count_fix(list_bugs)
                 logger.info(
                     f"DIFY: Counted {fix_count} bugs with 'FIX' action from list of {len(list_bugs)} bugs"
                 )
                 bugs_to_fix = fix_count
             if bugs_to_fix == 0:
-                return {
+                result = {
                     "success": True,
                     "bugs_to_fix": bugs_to_fix,
                     "list_bugs": list_bugs,
                     "message": "No bugs to fix",
                 }
-            return {
-                "success": True,
-                "list_bugs": list_bugs,
-                "bugs_to_fix": bugs_to_fix,
-                "message": f"Need to fix {bugs_to_fix} bugs",
-            }
+            else:
+                result = {
+                    "success": True,
+                    "list_bugs": list_bugs,
+                    "bugs_to_fix": bugs_to_fix,
+                    "message": f"Need to fix {bugs_to_fix} bugs",
+                }
+            self._cache_put(cache_key, result)
+            return result
         except Exception as e:
             logger.error(f"DIFY:Error in analysis_bugs_with_dify: {str(e)}")
             return {
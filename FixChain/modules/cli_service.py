@@ -1,8 +1,21 @@
 from __future__ import annotations
+import re
 import subprocess
 from typing import List, Optional, Sequence
 from utils.logger import logger
 
+# ANSI color/escape sequences emitted by scanners
+_ANSI_RE = re.compile(r'\x1b\[[0-9;]*m')
+STREAM_BUFSIZE = 65536
+STREAM_LOG_BATCH = 64
+
+
+def _log_batch(batch: List[str]) -> None:
+    # Ensure safe logging by encoding to ASCII once per batch
+    text = "\n".join(batch).encode('ascii', errors='ignore').decode('ascii')
+    if text.strip():
+        logger.info(text)
+
 class CLIService:
     """Helper service for running CLI commands with logging."""
 
@@ -57,11 +70,17 @@ class CLIService:
         cwd: Optional[str] = None,
         env: Optional[dict] = None,
         shell: bool = False,
+        collect: bool = True,
     ) -> tuple[bool, list[str]]:
         """Run a command and stream its output line by line.
 
+        Args:
+            collect: Keep the raw output lines for the caller. Pass False when only
+                the logged output is needed so memory stays bounded to one batch.
+
         Returns:
-            tuple[bool, list[str]]: Success flag and list of captured output lines.
+            tuple[bool, list[str]]: Success flag and list of captured output lines
+            (empty when ``collect`` is False).
         """
         output_lines: list[str] = []
         try:
@@ -72,25 +91,23 @@ class CLIService:
                 shell=shell,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                text=True,
+                bufsize=STREAM_BUFSIZE,
                 encoding="utf-8",
+                errors="replace",
             )
             assert process.stdout is not None
+            batch: List[str] = []
             for line in process.stdout:
-                output_lines.append(line)
-                try:
-                    # Clean ANSI escape sequences and handle Unicode characters
-                    clean_line = line.strip()
-                    # Remove ANSI escape sequences
-                    import re
-                    clean_line = re.sub(r'\x1b\[[0-9;]*m', '', clean_line)
-                    # Ensure safe logging by encoding to ASCII with error handling
-                    safe_line = clean_line.encode('ascii', errors='ignore').decode('ascii')
-                    if safe_line.strip():  # Only log non-empty lines
-                        logger.info(safe_line)
-                except Exception as e:
-                    # Fallback for any encoding issues
-                    logger.info("[OUTPUT] <line with encoding issues>")
+                if collect:
+                    output_lines.append(line)
+                clean_line = _ANSI_RE.sub('', line).strip()
+                if clean_line:  # Only log non-empty lines
+                    batch.append(clean_line)
+                if len(batch) >= STREAM_LOG_BATCH:
+                    _log_batch(batch)
+                    batch = []
+            if batch:
+                _log_batch(batch)
             return_code = process.wait()
             if return_code != 0:
                 logger.error(f"Command failed with return code {return_code}")
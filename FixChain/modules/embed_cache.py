@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from utils.logger import logger
+
+
+class EmbedCache:
+    """Persistent content-addressed cache for embedding vectors.
+
+    Keys are ``blake2b(model + "\\x00" + text)``; vectors are stored as
+    float32 bytes in a local SQLite file so identical texts are only
+    embedded once across imports, re-uploads and repeated queries.
+    """
+
+    def __init__(self, path: str, ttl_seconds: Optional[int] = 30 * 86400):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        logger.info(f"Embedding cache opened at {path}")
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.blake2b(f"{model}\x00{text}".encode("utf-8"), digest_size=32).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Return cached vectors in input order, ``None`` for misses or expired entries"""
+        keys = [self.make_key(model, text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        min_created = time.time() - self.ttl_seconds if self.ttl_seconds else 0
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLite limits bound parameters per statement; query in slices
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE created_at >= ? AND key IN ({placeholders})",
+                    [min_created, *batch],
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            vectors = [found.get(key) for key in keys]
+            hit_count = sum(1 for vector in vectors if vector is not None)
+            self.hits += hit_count
+            self.misses += len(vectors) - hit_count
+        return vectors
+
+    def put_many(self, model: str, texts: List[str], vectors: List[Optional[List[float]]]):
+        """Write-through for computed vectors; ``None`` entries are skipped"""
+        now = time.time()
+        rows = [
+            (self.make_key(model, text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+            if vector is not None
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    async def get_or_compute_many(
+        self,
+        model: str,
+        texts: List[str],
+        compute: Callable[[List[str]], Awaitable[List[Optional[List[float]]]]],
+    ) -> List[Optional[List[float]]]:
+        """Return vectors for ``texts``, calling ``compute`` only for cache misses"""
+        vectors = await asyncio.to_thread(self.get_many, model, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            computed = await compute(missing_texts)
+            await asyncio.to_thread(self.put_many, model, missing_texts, computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+        return vectors
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SemanticCache:
+    """Small in-memory cache keyed by embedding similarity.
+
+    Stores L2-normalised vectors in a NumPy matrix; ``get`` returns the value
+    of the most similar live entry when its cosine similarity reaches
+    ``threshold``. An optional hashable ``key`` (e.g. request parameters)
+    must match exactly for an entry to be considered. Oldest entries are
+    evicted once ``maxsize`` is reached.
+    """
+
+    def __init__(self, threshold: float = 0.97, maxsize: int = 256, ttl_seconds: Optional[float] = 3600):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._values: List = []
+        self._keys: List = []
+        self._created: List[float] = []
+
+    @staticmethod
+    def _normalize(vector) -> Optional[np.ndarray]:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            return None
+        return vec / norm
+
+    def _expire(self):
+        if not self.ttl_seconds or not self._values:
+            return
+        min_created = time.monotonic() - self.ttl_seconds
+        keep = [i for i, created in enumerate(self._created) if created >= min_created]
+        if len(keep) != len(self._values):
+            self._vectors = self._vectors[keep] if keep else None
+            self._values = [self._values[i] for i in keep]
+            self._keys = [self._keys[i] for i in keep]
+            self._created = [self._created[i] for i in keep]
+
+    def get(self, vector, key=None):
+        query = self._normalize(vector)
+        with self._lock:
+            self._expire()
+            if query is None or self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            scores = self._vectors @ query
+            same_key = np.fromiter((k == key for k in self._keys), dtype=bool, count=len(self._keys))
+            scores = np.where(same_key, scores, -np.inf)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                self.hits += 1
+                return self._values[best]
+            self.misses += 1
+            return None
+
+    def put(self, vector, value, key=None):
+        vec = self._normalize(vector)
+        if vec is None:
+            return
+        with self._lock:
+            self._expire()
+            if self._vectors is not None and self._vectors.shape[1] != vec.shape[0]:
+                return
+            if len(self._values) >= self.maxsize:
+                self._vectors = self._vectors[1:]
+                self._values = self._values[1:]
+                self._keys = self._keys[1:]
+                self._created = self._created[1:]
+            row = vec[np.newaxis, :]
+            self._vectors = row if self._vectors is None or not len(self._vectors) else np.vstack([self._vectors, row])
+            self._values.append(value)
+            self._keys.append(key)
+            self._created.append(time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._vectors = None
+            self._values = []
+            self._keys = []
+            self._created = []
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._values)}
+
+
+class VectorIndex:
+    """Exact in-memory cosine index over a collection's embeddings.
+
+    Rows are L2-normalised float32 (BLAS-backed; float16 products are not); a
+    search is a single matrix-vector product plus ``argpartition``, which for
+    collections of a few tens of thousands of vectors beats a network round trip
+    to a vector store. Rows live in a preallocated buffer that grows
+    geometrically, and ``add`` upserts by id so re-embedded documents replace
+    their old row.
+    """
+
+    def __init__(self, dtype=np.float32, capacity: int = 0):
+        self.dtype = dtype
+        self._lock = threading.Lock()
+        self._ids: List = []
+        self._rows: Dict = {}
+        self._capacity = capacity
+        self._matrix: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _reserve(self, size: int, dim: int):
+        """Make room for ``size`` rows, at least doubling the buffer when it grows"""
+        if self._matrix is None:
+            self._matrix = np.empty((max(size, self._capacity), dim), dtype=self.dtype)
+        elif size > self._matrix.shape[0]:
+            grown = np.empty((max(size, 2 * self._matrix.shape[0]), dim), dtype=self.dtype)
+            grown[:len(self._ids)] = self._matrix[:len(self._ids)]
+            self._matrix = grown
+
+    def add(self, ids: List, vectors: List):
+        """Insert or replace vectors; zero or malformed vectors are skipped"""
+        with self._lock:
+            dim = self._matrix.shape[1] if self._matrix is not None else None
+            count = len(self._ids)
+            new_ids, new_rows = [], []
+            for doc_id, vector in zip(ids, vectors):
+                vec = SemanticCache._normalize(vector) if vector is not None else None
+                if vec is None or vec.ndim != 1:
+                    continue
+                if dim is None:
+                    dim = vec.shape[0]
+                elif vec.shape[0] != dim:
+                    continue
+                row = self._rows.get(doc_id)
+                if row is None:
+                    self._rows[doc_id] = count + len(new_ids)
+                    new_ids.append(doc_id)
+                    new_rows.append(vec)
+                elif row >= count:
+                    # Repeated id within this batch: the later vector wins
+                    new_rows[row - count] = vec
+                else:
+                    self._matrix[row] = vec
+            if new_rows:
+                self._reserve(count + len(new_rows), dim)
+                self._matrix[count:count + len(new_rows)] = new_rows
+                self._ids.extend(new_ids)
+
+    def search(self, vector, k: int) -> List[tuple]:
+        """Top ``k`` ``(id, cosine)`` pairs, best first"""
+        query = SemanticCache._normalize(vector)
+        with self._lock:
+            if query is None or not self._ids or self._matrix.shape[1] != query.shape[0]:
+                return []
+            scores = self._matrix[:len(self._ids)] @ query.astype(self.dtype)
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[i], float(scores[i])) for i in top]
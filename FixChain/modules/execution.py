@@ -1,22 +1,47 @@
 import os
+import re
+import hashlib
 import json
-import subprocess
+import queue
+import asyncio
+import shutil
+import threading
 import time
 from datetime import datetime
 from typing import List, Dict, Optional
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from utils.logger import logger
-from lib.dify_lib import DifyMode, run_workflow_with_dify
+from lib.dify_lib import DifyMode, run_dify, run_workflow_with_dify
+from .analysis_service import serialize_report
+from .cli_service import CLIService
 from .mongodb_service import MongoDBService
 
+# SonarQube Web API
+SONAR_PAGE_SIZE = 500
+SONAR_HTTP_TIMEOUT = 30  # seconds per request
+SONAR_CE_TIMEOUT = 120  # seconds to wait for the Compute Engine task
+SONAR_CE_POLL_MIN = 0.1
+SONAR_CE_POLL_MAX = 2.0
+SONAR_CE_DONE = {"SUCCESS", "FAILED", "CANCELED"}
+SONAR_EXCERPT_RADIUS = 10
+
+EXECUTION_LOG_DIR = "d:\\ILA\\FixChain\\logs"
+EXECUTION_LOG_BUFFER = 1 << 16
+
+RAG_IMPORT_URL = "http://localhost:8000/api/v1/bugs/bugs/import"
+RAG_IMPORT_TIMEOUT = (3.05, 30)  # (connect, read)
+
 
 class ExecutionService:
     def __init__(self):
         # Load environment variables
         self.dify_cloud_api_key = os.getenv('DIFY_CLOUD_API_KEY')
         self.dify_local_api_key = os.getenv('DIFY_LOCAL_API_KEY')
-        self.sonar_host = os.getenv('SONAR_HOST', 'http://localhost:9000')
+        self.sonar_host = os.getenv('SONAR_HOST', 'http://localhost:9000').rstrip('/')
         self.sonar_token = os.getenv('SONAR_TOKEN')
         self.sonarq_path = os.getenv('SONARQ_PATH', os.path.join(os.getcwd(), 'SonarQ'))
         
@@ -28,6 +53,27 @@ class ExecutionService:
         self.project_key = os.getenv('PROJECT_KEY')
         self.source_code_path = os.getenv('SOURCE_CODE_PATH')
         
+        # Persistent session for SonarQube Web API (issues, rules, CE status)
+        self._http = requests.Session()
+        self._http.auth = (self.sonar_token or "", "")
+        self._rule_desc_cache: Dict[str, str] = {}
+        # full_path -> (st_mtime_ns, content)
+        self._src_cache: Dict[str, tuple] = {}
+        
+        # Pooled session for the RAG API. urllib3 only retries the (non-idempotent)
+        # import POST on connection errors, so a bug batch is never sent twice
+        self._rag_session = requests.Session()
+        self._rag_session.mount("http://", HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=10,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+        ))
+        
+        # Execution log: one NDJSON file per run, Mongo inserts on a worker thread
+        self._log_fh = None
+        self._log_queue: "queue.Queue[Optional[Dict]]" = queue.Queue()
+        self._log_worker: Optional[threading.Thread] = None
+        
         # Execution tracking
         self.execution_count = 0
         self.current_source_file = 'code.py'  # Track current source file to scan
@@ -58,12 +104,103 @@ class ExecutionService:
             
         logger.info(f"Project configured: {self.project_key} at {self.source_code_path}")
     
+    def _sonar_json(self, path: str, params: Dict) -> Dict:
+        resp = self._http.get(f"{self.sonar_host}{path}", params=params, timeout=SONAR_HTTP_TIMEOUT)
+        resp.raise_for_status()
+        # Parse the raw body bytes directly (issue pages can be several MB)
+        return orjson.loads(resp.content)
+    
+    def _wait_ce_complete(self, timeout: float = SONAR_CE_TIMEOUT) -> bool:
+        """Poll the project's Compute Engine status with backoff until the submitted analysis finishes.
+
+        Returns True when the latest task ended with SUCCESS.
+        """
+        deadline = time.monotonic() + timeout
+        delay = SONAR_CE_POLL_MIN
+        while True:
+            status = self._sonar_json("/api/ce/component", {"component": self.project_key})
+            current = status.get("current") or {}
+            # The scanner submits its report before exiting, so an empty queue
+            # means our task has moved to "current"
+            if not status.get("queue") and current.get("status") in SONAR_CE_DONE:
+                if current["status"] != "SUCCESS":
+                    logger.warning(f"SonarQube background task ended with {current['status']}")
+                return current["status"] == "SUCCESS"
+            if time.monotonic() + delay > deadline:
+                logger.warning(f"SonarQube background task not finished after {timeout}s")
+                return False
+            time.sleep(delay)
+            delay = min(delay * 1.5, SONAR_CE_POLL_MAX)
+    
+    def _fetch_rule_descriptions(self, rule_keys) -> Dict[str, str]:
+        # Rule descriptions don't change between iterations -> cache per service
+        for rule_key in rule_keys:
+            if rule_key in self._rule_desc_cache:
+                continue
+            desc = ""
+            try:
+                rule = self._sonar_json("/api/rules/show", {"key": rule_key}).get("rule", {})
+                desc = rule.get("htmlDesc") or rule.get("mdDesc") or rule.get("name") or ""
+                desc = re.sub("<[^<]+?>", "", desc).strip()
+            except (requests.RequestException, orjson.JSONDecodeError) as e:
+                logger.warning(f"Could not fetch SonarQube rule {rule_key}: {str(e)}")
+            self._rule_desc_cache[rule_key] = desc
+        return self._rule_desc_cache
+    
+    def _fetch_code_excerpt(self, component: str, line: Optional[int]) -> Optional[str]:
+        if not line:
+            return None
+        params = {"key": component, "from": max(1, line - SONAR_EXCERPT_RADIUS), "to": line + SONAR_EXCERPT_RADIUS}
+        try:
+            sources = self._sonar_json("/api/sources/lines", params).get("sources", [])
+        except (requests.RequestException, orjson.JSONDecodeError):
+            return None
+        out = [f"{e.get('line'):>5}: {e.get('code', '')}" for e in sources]
+        return "\n".join(out) if out else None
+    
+    def _fetch_issues_via_api(self) -> List[Dict]:
+        """Fetch project issues from /api/issues/search in the same shape export_issues.py prints"""
+        issues = []
+        page = 1
+        while True:
+            params = {"componentKeys": self.project_key, "p": page, "ps": SONAR_PAGE_SIZE}
+            js = self._sonar_json("/api/issues/search", params)
+            issues.extend(js.get("issues", []))
+            if page * SONAR_PAGE_SIZE >= js.get("total", 0):
+                break
+            page += 1
+        
+        rule_desc = self._fetch_rule_descriptions(sorted({i.get("rule") for i in issues if i.get("rule")}))
+        prefix = f"{self.project_key}:"
+        bugs = []
+        for issue in issues:
+            component = issue.get("component") or ""
+            rule_key = issue.get("rule")
+            line = issue.get("line")
+            bugs.append({
+                "bug_id": issue.get("key"),
+                "bug_name": issue.get("message"),
+                "rule_key": rule_key,
+                "severity": issue.get("severity"),
+                "type": issue.get("type"),
+                "file_path": component[len(prefix):] if component.startswith(prefix) else component,
+                "line": line,
+                "message": issue.get("message"),
+                "status": issue.get("status"),
+                "resolution": issue.get("resolution"),
+                "created_at": issue.get("creationDate"),
+                "updated_at": issue.get("updateDate"),
+                "rule_description": rule_desc.get(rule_key, ""),
+                "code_excerpt": self._fetch_code_excerpt(component, line),
+            })
+        return bugs
+    
     def scan_sonarq_bugs(self) -> List[Dict]:
         """Scan SonarQube to get list of bugs
         
         This method performs a complete SonarQube scan:
         1. Run SonarQube scan using run_scan.bat
-        2. Export issues using export_issues.py
+        2. Wait for the Compute Engine task, then read issues from the Web API
         """
         try:
             logger.info(f"Starting SonarQube scan for project: {self.project_key}")
@@ -79,52 +216,32 @@ class ExecutionService:
             env['SONAR_TOKEN'] = self.sonar_token
             env['SONAR_HOST'] = self.sonar_host
             
-            # Run scan (this may take a while)
-            scan_result = subprocess.run(
+            # Run scan (this may take a while); output is logged as it arrives.
+            # .bat files need cmd.exe, so the shell is only used on Windows
+            scan_ok, _ = CLIService.run_command_stream(
                 scan_cmd,
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                env=env,
                 cwd=self.sonarq_path,
-                shell=True
+                env=env,
+                shell=os.name == 'nt',
+                collect=False
             )
             
-            if scan_result.returncode != 0:
-                logger.error(f"SonarQube scan failed: {scan_result.stderr}")
-                logger.error(f"Scan output: {scan_result.stdout}")
+            if not scan_ok:
+                logger.error("SonarQube scan failed")
                 return []
             
             logger.info("SonarQube scan completed successfully")
             
-            # Step 2: Wait a bit for SonarQube to process results
+            # Step 2: Wait for SonarQube to process results
             logger.info("Waiting for SonarQube to process results...")
-            time.sleep(10)  # Wait 10 seconds for background processing
-            
-            # Step 3: Export issues
-            logger.info("Step 2: Exporting issues...")
-            export_cmd = [
-                'python',
-                os.path.join(self.sonarq_path, 'export_issues.py'),
-                self.project_key,
-                self.sonar_host
-            ]
-            
-            export_result = subprocess.run(
-                export_cmd, 
-                capture_output=True, 
-                text=True, 
-                encoding='utf-8',
-                env=env
-            )
-            
-            if export_result.returncode != 0:
-                logger.error(f"Issues export failed: {export_result.stderr}")
+            if not self._wait_ce_complete():
+                # Issues API would still hold the previous analysis
+                logger.error("SonarQube analysis did not complete successfully")
                 return []
             
-            # Parse JSON output
-            bugs_data = json.loads(export_result.stdout)
-            bugs = bugs_data.get('issues', [])
+            # Step 3: Fetch issues
+            logger.info("Step 2: Fetching issues from SonarQube Web API...")
+            bugs = self._fetch_issues_via_api()
             
             logger.info(f"Found {len(bugs)} bugs in SonarQube scan")
             return bugs
@@ -141,29 +258,58 @@ class ExecutionService:
                 file_path = self.current_source_file
                 
             full_path = os.path.join(self.source_code_path, file_path)
+            mtime = os.stat(full_path).st_mtime_ns
+            cached = self._src_cache.get(full_path)
+            if cached and cached[0] == mtime:
+                return cached[1]
             with open(full_path, 'r', encoding='utf-8') as f:
-                return f.read()
+                content = f.read()
+            self._src_cache[full_path] = (mtime, content)
+            return content
         except Exception as e:
             logger.error(f"Error reading source code from {file_path}: {str(e)}")
             return ""
     
+    def _source_fingerprint(self) -> bytes:
+        """Digest of the current source file, used to detect already-scanned versions"""
+        return hashlib.blake2b(self.read_source_code().encode('utf-8'), digest_size=16).digest()
+    
+    def _check_converged(self, scanned: set, iteration: int, execution_summary: Dict) -> bool:
+        # Same source as an earlier scan -> SonarQube would report the same bugs again
+        src_sha = self._source_fingerprint()
+        if src_sha in scanned:
+            logger.info("Source matches an already scanned version. Skipping re-scan.")
+            execution_summary["iterations"].append({
+                "iteration": iteration,
+                "bugs_found": None,
+                "fix_result": {"success": True, "message": "converged"}
+            })
+            return True
+        scanned.add(src_sha)
+        return False
+    
     def write_source_code(self, file_path: str, content: str) -> bool:
         """Write fixed code back to file"""
         try:
             full_path = os.path.join(self.source_code_path, file_path)
+            self._src_cache.pop(full_path, None)
             
             # Create backup
             backup_path = f"{full_path}.backup.{int(time.time())}"
             if os.path.exists(full_path):
-                with open(full_path, 'r', encoding='utf-8') as f:
-                    backup_content = f.read()
-                with open(backup_path, 'w', encoding='utf-8') as f:
-                    f.write(backup_content)
+                # Hard link keeps the old inode as the backup without copying bytes;
+                # fall back to a metadata-preserving copy where links aren't supported
+                try:
+                    os.link(full_path, backup_path)
+                except OSError:
+                    shutil.copy2(full_path, backup_path)
                 logger.info(f"Created backup: {backup_path}")
             
-            # Write new content
-            with open(full_path, 'w', encoding='utf-8') as f:
+            # Write new content to a temp file and publish it atomically
+            tmp_path = f"{full_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
                 f.write(content)
+            os.replace(tmp_path, full_path)
             
             logger.info(f"Updated source code: {file_path}")
             return True
@@ -172,8 +318,12 @@ class ExecutionService:
             logger.error(f"Error writing source code to {file_path}: {str(e)}")
             return False
     
-    def fix_bugs_with_dify(self, bugs: List[Dict], use_rag: bool = False, mode: DifyMode = DifyMode.CLOUD) -> Dict:
-        """Fix bugs using Dify API"""
+    def fix_bugs_with_dify(self, bugs: List[Dict], use_rag: bool = False, mode: DifyMode = DifyMode.CLOUD, report_json: Optional[str] = None) -> Dict:
+        """Fix bugs using Dify API (sync; don't call from a running event loop)"""
+        return run_dify(self.fix_bugs_with_dify_async(bugs, use_rag=use_rag, mode=mode, report_json=report_json))
+
+    async def fix_bugs_with_dify_async(self, bugs: List[Dict], use_rag: bool = False, mode: DifyMode = DifyMode.CLOUD, report_json: Optional[str] = None) -> Dict:
+        """Fix bugs using Dify API; awaited by the run loops on their shared Dify client"""
         try:
             # Choose API key based on mode
             api_key = self.dify_cloud_api_key if mode == DifyMode.CLOUD else self.dify_local_api_key
@@ -192,13 +342,13 @@ class ExecutionService:
             inputs = {
                 "is_use_rag": use_rag,
                 "src": source_code,
-                "report": json.dumps(bugs, ensure_ascii=False),
+                "report": report_json if report_json is not None else serialize_report(bugs),
             }
             
             logger.info(f"Fixing {len(bugs)} bugs using Dify")
             
             # Call Dify workflow once with all bugs
-            response = run_workflow_with_dify(
+            response = await run_workflow_with_dify(
                 api_key=api_key,
                 inputs=inputs,
                 user="execution_service",
@@ -277,6 +427,45 @@ class ExecutionService:
             logger.error(f"Error in fix_bugs_with_dify: {str(e)}")
             return {"success": False, "error": str(e)}
     
+    def _mongo_log_worker(self):
+        while True:
+            log_entry = self._log_queue.get()
+            try:
+                if log_entry is None:
+                    return
+                self.mongodb_service.insert_execution_log(log_entry)
+            except Exception as e:
+                logger.error(f"Error logging execution result to database: {str(e)}")
+            finally:
+                self._log_queue.task_done()
+    
+    def _open_execution_log(self):
+        if self._log_fh is None:
+            os.makedirs(EXECUTION_LOG_DIR, exist_ok=True)
+            log_filename = f"execution_{self.project_key}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson"
+            self._log_fh = open(
+                os.path.join(EXECUTION_LOG_DIR, log_filename), 'a',
+                buffering=EXECUTION_LOG_BUFFER, encoding='utf-8'
+            )
+        if self._log_worker is None or not self._log_worker.is_alive():
+            self._log_worker = threading.Thread(target=self._mongo_log_worker, daemon=True)
+            self._log_worker.start()
+        return self._log_fh
+    
+    def close_execution_log(self):
+        """Flush the run's log file and wait for pending database inserts"""
+        try:
+            if self._log_worker is not None and self._log_worker.is_alive():
+                self._log_queue.put(None)
+                self._log_queue.join()
+            self._log_worker = None
+            if self._log_fh is not None:
+                self._log_fh.close()
+        except Exception as e:
+            logger.error(f"Error closing execution log: {str(e)}")
+        finally:
+            self._log_fh = None
+    
     def log_execution_result(self, iteration: int, result: Dict, use_rag: bool):
         """Log execution result to file and database"""
         try:
@@ -289,18 +478,11 @@ class ExecutionService:
                 "result": result
             }
             
-            # Log to file
-            log_dir = "d:\\ILA\\FixChain\\logs"
-            os.makedirs(log_dir, exist_ok=True)
-            
-            log_filename = f"execution_{self.project_key}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            log_path = os.path.join(log_dir, log_filename)
-            
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps(log_entry, ensure_ascii=False, indent=2) + "\n")
+            # Log to file (one JSON document per line)
+            self._open_execution_log().write(orjson.dumps(log_entry).decode('utf-8') + "\n")
             
-            # Log to database
-            self.mongodb_service.insert_execution_log(log_entry)
+            # Log to database in the background
+            self._log_queue.put(log_entry)
             
             logger.info(f"Logged execution result for iteration {iteration}")
             
@@ -308,8 +490,15 @@ class ExecutionService:
             logger.error(f"Error logging execution result: {str(e)}")
     
     def run_without_rag(self, mode: DifyMode = DifyMode.CLOUD) -> Dict:
+        """Run execution without RAG (sync entry point, see run_without_rag_async)"""
+        return run_dify(self.run_without_rag_async(mode=mode))
+    
+    async def run_without_rag_async(self, mode: DifyMode = DifyMode.CLOUD) -> Dict:
         """Run execution without RAG
         
+        All iterations run on one event loop, so every Dify call reuses the
+        same keep-alive client; blocking steps run in worker threads.
+        
         Steps:
         1. Scan SonarQ -> List Bug
         2. Source + List Bug -> Dify -> Code Fixed
@@ -329,11 +518,15 @@ class ExecutionService:
             "start_time": datetime.now().isoformat()
         }
         
+        scanned_sources = set()
         for iteration in range(1, self.max_iterations + 1):
             logger.info(f"=== Iteration {iteration}/{self.max_iterations} ===")
             
+            if self._check_converged(scanned_sources, iteration, execution_summary):
+                break
+            
             # Step 1: Scan SonarQ -> List Bug
-            bugs = self.scan_sonarq_bugs()
+            bugs = await asyncio.to_thread(self.scan_sonarq_bugs)
             
             # Log iteration result with bugs found
             iteration_result = {
@@ -349,7 +542,8 @@ class ExecutionService:
                 break
             
             # Step 2: Source + List Bug -> Dify -> Code Fixed
-            fix_result = self.fix_bugs_with_dify(bugs, use_rag=False, mode=mode)
+            report_json = serialize_report(bugs)
+            fix_result = await self.fix_bugs_with_dify_async(bugs, use_rag=False, mode=mode, report_json=report_json)
             
             # Update iteration result with fix result
             iteration_result["fix_result"] = fix_result
@@ -366,6 +560,7 @@ class ExecutionService:
             
             logger.info(f"Iteration {iteration} completed. Fixed {fix_result.get('fixed_count', 0)} bugs.")
         
+        await asyncio.to_thread(self.close_execution_log)
         execution_summary["end_time"] = datetime.now().isoformat()
         logger.info(f"Execution WITHOUT RAG completed. Total bugs fixed: {execution_summary['total_bugs_fixed']}")
         
@@ -374,18 +569,20 @@ class ExecutionService:
     def insert_dataset_to_rag(self, dataset_path: str) -> bool:
         """Insert dataset to RAG system"""
         try:
-            with open(dataset_path, 'r', encoding='utf-8') as f:
-                bugs_data = json.load(f)
+            with open(dataset_path, 'rb') as f:
+                bugs_data = orjson.loads(f.read())
             
-            response = requests.post(f"http://localhost:8000/api/v1/bugs/bugs/import", json=bugs_data)
+            response = self._rag_session.post(RAG_IMPORT_URL, json=bugs_data, timeout=RAG_IMPORT_TIMEOUT)
             logger.info(f"Status Code: {response.status_code}")
             
+            if response.status_code != 200:
+                logger.warning(f"❌ Import thất bại: {response.text}")
+                return False
             
-            if response.status_code == 200:
-                result = response.json()
-                logger.info(f"✅ Import thành công!")
-                logger.info(f"   - Imported: {result['imported_count']} bugs")
-                logger.info(f"   - Failed: {result['failed_count']} bugs")
+            result = response.json()
+            logger.info(f"✅ Import thành công!")
+            logger.info(f"   - Imported: {result['imported_count']} bugs")
+            logger.info(f"   - Failed: {result['failed_count']} bugs")
             logger.info(f"   - Batch: {result['batch_name']}")
             logger.info(f"   - Project: {result['project']}")
             
@@ -393,16 +590,11 @@ class ExecutionService:
                 logger.info("\n📋 Danh sách bugs đã import:")
                 for bug in result['imported_bugs'][:3]:  # Show first 3
                     logger.info(f"   - {bug['bug_name']} ({bug['type']}, {bug['severity']})")
-                return True
             if result['failed_bugs']:
                 logger.warning("\n❌ Bugs import thất bại:")
                 for bug in result['failed_bugs']:
                     logger.warning(f"   - {bug['bug_name']}: {bug['error']}")
-                return True
-            
-            else:
-                logger.warning(f"❌ Import thất bại: {response.text}")
-                return False
+            return True
 
         except Exception as e:
             logger.error(f"❌ Lỗi kết nối: {e}")
@@ -410,8 +602,14 @@ class ExecutionService:
 
             
     def run_with_rag(self, dataset_path: str = None, mode: DifyMode = DifyMode.CLOUD) -> Dict:
+        """Run execution with RAG (sync entry point, see run_with_rag_async)"""
+        return run_dify(self.run_with_rag_async(dataset_path=dataset_path, mode=mode))
+    
+    async def run_with_rag_async(self, dataset_path: str = None, mode: DifyMode = DifyMode.CLOUD) -> Dict:
         """Run execution with RAG
         
+        Same event-loop model as run_without_rag_async.
+        
         Args:
             dataset_path: Path to RAG dataset file (optional, uses env var if not provided)
             mode: Dify mode (cloud or local)
@@ -435,7 +633,7 @@ class ExecutionService:
                 return {"success": False, "error": "RAG_DATASET_PATH must be set in environment or provided as parameter"}
         
         # Step 1: Insert Dataset -> RAG
-        if not self.insert_dataset_to_rag(dataset_path):
+        if not await asyncio.to_thread(self.insert_dataset_to_rag, dataset_path):
             return {"success": False, "error": "Failed to insert dataset to RAG"}
         
         execution_summary = {
@@ -447,18 +645,23 @@ class ExecutionService:
             "start_time": datetime.now().isoformat()
         }
         
+        scanned_sources = set()
         for iteration in range(1, self.max_iterations + 1):
             logger.info(f"=== Iteration {iteration}/{self.max_iterations} (WITH RAG) ===")
             
+            if self._check_converged(scanned_sources, iteration, execution_summary):
+                break
+            
             # Step 2: Scan SonarQ -> List Bug
-            bugs = self.scan_sonarq_bugs()
+            bugs = await asyncio.to_thread(self.scan_sonarq_bugs)
             
             if not bugs:
                 logger.info("No bugs found. Execution completed.")
                 break
             
             # Step 3: Source + List Bug -> Dify -> Code Fixed -> RAG
-            fix_result = self.fix_bugs_with_dify(bugs, use_rag=True, mode=mode)
+            report_json = serialize_report(bugs)
+            fix_result = await self.fix_bugs_with_dify_async(bugs, use_rag=True, mode=mode, report_json=report_json)
             
             # Log iteration result
             iteration_result = {
@@ -479,6 +682,7 @@ class ExecutionService:
             
             logger.info(f"Iteration {iteration} completed. Fixed {fix_result.get('fixed_count', 0)} bugs.")
         
+        await asyncio.to_thread(self.close_execution_log)
         execution_summary["end_time"] = datetime.now().isoformat()
         logger.info(f"Execution WITH RAG completed. Total bugs fixed: {execution_summary['total_bugs_fixed']}")
         
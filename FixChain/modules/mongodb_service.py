@@ -1,9 +1,13 @@
 import os
 import json
 import math
+import uuid
 from datetime import datetime
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from bson.binary import Binary
+import numpy as np
 from pymongo.collection import Collection
 from pymongo.database import Database
 from dotenv import load_dotenv
@@ -13,6 +17,29 @@ from utils.logger import logger
 root_env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.env')
 load_dotenv(root_env_path)
 
+def dequantize_vector(stored, dtype: Optional[str] = None, scale: Optional[float] = None) -> np.ndarray:
+    """Decode a stored vector: int8 codes (with scale) or a plain float list"""
+    if dtype == "int8":
+        return dequantize_int8(stored, scale or 1.0)
+    return np.asarray(stored, dtype=np.float32)
+
+def quantize_int8(embedding: List[float]) -> Tuple[Binary, float]:
+    """Scalar-quantise an L2-normalised embedding to int8 bytes plus its scale"""
+    vec = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    if norm:
+        vec = vec / norm
+    scale = float(np.abs(vec).max()) / 127 or 1.0
+    codes = np.round(vec / scale).astype(np.int8)
+    return Binary(codes.tobytes()), scale
+
+def dequantize_int8(stored, scale: float) -> np.ndarray:
+    """Inverse of ``quantize_int8`` (up to rounding)"""
+    return np.frombuffer(stored, dtype=np.int8).astype(np.float32) * scale
+
+# Fields needed to decode any stored vector format
+EMBEDDING_PROJECTION = {"doc_id": 1, "vector": 1, "dtype": 1, "scale": 1, "_id": 0}
+
 class MongoDBManager:
     def __init__(self):
         self.client = None
@@ -33,7 +60,14 @@ class MongoDBManager:
             mongo_url = os.getenv("MONGODB_URI", default_url)
             db_name = os.getenv("MONGODB_DATABASE", "rag_db")
             
-            self.client = MongoClient(mongo_url)
+            # One pooled client for the lifetime of the app
+            self.client = MongoClient(
+                mongo_url,
+                maxPoolSize=int(os.getenv("MONGODB_MAX_POOL_SIZE", "50")),
+                minPoolSize=int(os.getenv("MONGODB_MIN_POOL_SIZE", "10")),
+                waitQueueTimeoutMS=2000,
+                retryWrites=True
+            )
             self.db = self.client[db_name]
             
             # Get collections
@@ -75,9 +109,12 @@ class MongoDBManager:
             
             # Insert embedding if provided
             if embedding:
+                codes, scale = quantize_int8(embedding)
                 embedding_doc = {
                     "doc_id": doc_id,
-                    "vector": embedding,
+                    "vector": codes,
+                    "dtype": "int8",
+                    "scale": scale,
                     "dimension": len(embedding),
                     "created_at": datetime.now()
                 }
@@ -88,6 +125,104 @@ class MongoDBManager:
         except Exception as e:
             raise Exception(f"Error adding document to MongoDB: {str(e)}")
     
+    def ensure_bug_indexes(self):
+        """Compound index covering the bug stats pipeline ($match + $project)"""
+        try:
+            self.documents_collection.create_index(
+                [
+                    ("metadata.document_type", 1),
+                    ("metadata.bug_type", 1),
+                    ("metadata.severity", 1),
+                    ("metadata.status", 1),
+                    ("metadata.project", 1),
+                ],
+                name="bug_stats_idx"
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Could not create bug stats index: {e}")
+
+    def ping(self) -> bool:
+        """Keepalive ping; logs the topology so pool saturation can be tracked"""
+        try:
+            self.client.admin.command('ping')
+            topology = self.client.topology_description
+            servers = ", ".join(
+                f"{address[0]}:{address[1]}({server.server_type_name})"
+                for address, server in topology.server_descriptions().items()
+            )
+            logger.debug(f"MongoDB ping ok - {topology.topology_type_name}: {servers}")
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ MongoDB ping failed: {e}")
+            return False
+
+    def bulk_add_documents(
+        self,
+        contents: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Dict]
+    ) -> Tuple[List[Optional[str]], Dict[int, str]]:
+        """Insert many documents (and their embeddings) in one round trip per collection
+
+        Returns ``(doc_ids, errors)``: ``doc_ids[i]`` is None when document ``i``
+        failed, and ``errors`` maps that index to the write error message.
+        """
+        if not contents:
+            return [], {}
+
+        now = datetime.now()
+        doc_ids = [f"doc_{uuid.uuid4().hex}" for _ in contents]
+        documents = [
+            {
+                "doc_id": doc_id,
+                "content": content,
+                "metadata": {
+                    **(metadata or {}),
+                    "timestamp": now.isoformat(),
+                    "created_at": now
+                },
+                "created_at": now,
+                "updated_at": now
+            }
+            for doc_id, content, metadata in zip(doc_ids, contents, metadatas)
+        ]
+
+        errors: Dict[int, str] = {}
+        try:
+            self.documents_collection.insert_many(
+                documents, ordered=False, bypass_document_validation=True
+            )
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                errors[write_error["index"]] = write_error.get("errmsg", "write error")
+        except Exception as e:
+            raise Exception(f"Error adding documents to MongoDB: {str(e)}")
+
+        embedding_docs = []
+        for i, embedding in enumerate(embeddings):
+            if not embedding or i in errors:
+                continue
+            codes, scale = quantize_int8(embedding)
+            embedding_docs.append({
+                "doc_id": doc_ids[i],
+                "vector": codes,
+                "dtype": "int8",
+                "scale": scale,
+                "dimension": len(embedding),
+                "created_at": now
+            })
+        if embedding_docs:
+            try:
+                self.embeddings_collection.insert_many(
+                    embedding_docs, ordered=False, bypass_document_validation=True
+                )
+            except BulkWriteError as e:
+                logger.error(f"❌ {len(e.details.get('writeErrors', []))} embeddings failed to insert")
+            except Exception as e:
+                raise Exception(f"Error adding embeddings to MongoDB: {str(e)}")
+
+        return [None if i in errors else doc_id for i, doc_id in enumerate(doc_ids)], errors
+
     def search_documents(self, query: str, top_k: int = 5) -> List[Dict]:
         """Search documents using text search"""
         try:
@@ -111,16 +246,46 @@ class MongoDBManager:
         except Exception as e:
             raise Exception(f"Error searching documents: {str(e)}")
     
-    def search_by_embedding(self, query_embedding: List[float], top_k: int = 5) -> List[Dict]:
-        """Search documents by embedding similarity (simplified cosine similarity)"""
+    def search_by_embedding(
+        self,
+        query_embedding: List[float],
+        top_k: int = 5,
+        metadata_filter: Optional[Dict[str, Any]] = None
+    ) -> List[Dict]:
+        """Search documents by embedding similarity (simplified cosine similarity)
+
+        ``metadata_filter`` is a Mongo filter on the documents collection
+        (e.g. ``{"metadata.severity": {"$in": [...]}}``); only embeddings of
+        matching documents are scored, so ``top_k`` results all satisfy it.
+        """
         try:
-            # Get all embeddings
-            all_embeddings = list(self.embeddings_collection.find())
-            
-            # Calculate similarities
+            if metadata_filter:
+                # Pre-filter server-side: candidate doc ids first, then their vectors
+                candidate_ids = [
+                    doc["doc_id"]
+                    for doc in self.documents_collection.find(metadata_filter, {"doc_id": 1, "_id": 0})
+                    if "doc_id" in doc
+                ]
+                if not candidate_ids:
+                    return []
+                all_embeddings = list(self.embeddings_collection.find(
+                    {"doc_id": {"$in": candidate_ids}}, EMBEDDING_PROJECTION
+                ))
+            else:
+                # Get all embeddings
+                all_embeddings = list(self.embeddings_collection.find({}, EMBEDDING_PROJECTION))
+            
+            # Calculate similarities (stored vectors may be int8 codes or float lists)
             similarities = []
+            query = np.asarray(query_embedding, dtype=np.float32)
+            query_norm = np.linalg.norm(query)
             for emb_doc in all_embeddings:
-                similarity = self.cosine_similarity(query_embedding, emb_doc["vector"])
+                vector = dequantize_vector(emb_doc["vector"], emb_doc.get("dtype"), emb_doc.get("scale"))
+                norm = np.linalg.norm(vector)
+                if query_norm == 0 or norm == 0 or vector.shape != query.shape:
+                    similarity = self.cosine_similarity(query_embedding, vector.tolist())
+                else:
+                    similarity = float(vector @ query) / float(norm * query_norm)
                 similarities.append({
                     "doc_id": emb_doc["doc_id"],
                     "similarity": similarity
@@ -130,14 +295,16 @@ class MongoDBManager:
             similarities.sort(key=lambda x: x["similarity"], reverse=True)
             
             # Get top documents
-            top_doc_ids = [item["doc_id"] for item in similarities[:top_k]]
+            top_scores = {item["doc_id"]: item["similarity"] for item in similarities[:top_k]}
             
             # Fetch documents
             documents = []
-            for doc_id in top_doc_ids:
-                doc = self.documents_collection.find_one({"doc_id": doc_id})
+            for doc_id, similarity_score in top_scores.items():
+                # Vectors are only needed for scoring; result rows carry content + metadata
+                doc = self.documents_collection.find_one(
+                    {"doc_id": doc_id}, {"doc_id": 1, "content": 1, "metadata": 1, "_id": 0}
+                )
                 if doc:
-                    similarity_score = next(item["similarity"] for item in similarities if item["doc_id"] == doc_id)
                     documents.append({
                         "doc_id": doc["doc_id"],
                         "content": doc["content"],
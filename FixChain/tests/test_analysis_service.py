@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+import modules.analysis_service as analysis_service
+from lib.dify_lib import DifyMode
+from modules.analysis_service import AnalysisService
+
+
+@pytest.fixture
+def dify_calls(monkeypatch):
+    calls = []
+
+    async def fake_workflow(**kwargs):
+        calls.append(kwargs)
+        return {"data": {"outputs": {"list_bugs": [{"action": "Fix"}, {"action": "ignore"}]}}}
+
+    monkeypatch.setattr(analysis_service, "run_workflow_with_dify", fake_workflow)
+    return calls
+
+
+BUGS = [{"type": "BUG", "message": "x"}]
+
+
+def test_repeat_analysis_is_served_from_cache(dify_calls):
+    service = AnalysisService("cloud-key", "local-key")
+
+    first = service.analyze_bugs_with_dify(BUGS, source_code="print(1)")
+    second = service.analyze_bugs_with_dify(BUGS, source_code="print(1)")
+
+    assert len(dify_calls) == 1
+    assert first == second
+    assert first["bugs_to_fix"] == 1
+
+    # Callers get their own copy
+    second["list_bugs"].append({"action": "Fix"})
+    assert service.analyze_bugs_with_dify(BUGS, source_code="print(1)")["list_bugs"] == first["list_bugs"]
+
+
+def test_changed_inputs_miss_the_cache(dify_calls):
+    service = AnalysisService("cloud-key", "local-key")
+
+    service.analyze_bugs_with_dify(BUGS, source_code="print(1)")
+    service.analyze_bugs_with_dify(BUGS, source_code="print(2)")
+    service.analyze_bugs_with_dify(BUGS, source_code="print(1)", use_rag=True)
+    service.analyze_bugs_with_dify(BUGS, source_code="print(1)", mode=DifyMode.LOCAL)
+    service.analyze_bugs_with_dify(BUGS + BUGS, source_code="print(1)")
+
+    assert len(dify_calls) == 5
+
+
+def test_cache_entries_expire_and_are_evicted(dify_calls, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(analysis_service.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(analysis_service, "ANALYSIS_CACHE_MAXSIZE", 2)
+    service = AnalysisService("cloud-key", "local-key")
+
+    service.analyze_bugs_with_dify(BUGS, source_code="a")
+    now[0] += analysis_service.ANALYSIS_CACHE_TTL + 1
+    service.analyze_bugs_with_dify(BUGS, source_code="a")
+    assert len(dify_calls) == 2
+
+    service.analyze_bugs_with_dify(BUGS, source_code="b")
+    service.analyze_bugs_with_dify(BUGS, source_code="c")  # evicts "a"
+    service.analyze_bugs_with_dify(BUGS, source_code="a")
+    assert len(dify_calls) == 5
+
+
+def test_failed_analysis_is_not_cached(monkeypatch):
+    calls = []
+
+    async def failing_workflow(**kwargs):
+        calls.append(kwargs)
+        raise RuntimeError("dify down")
+
+    monkeypatch.setattr(analysis_service, "run_workflow_with_dify", failing_workflow)
+    service = AnalysisService("cloud-key", "local-key")
+
+    assert service.analyze_bugs_with_dify(BUGS, source_code="a")["success"] is False
+    service.analyze_bugs_with_dify(BUGS, source_code="a")
+    assert len(calls) == 2
@@ -0,0 +1,49 @@
+from pathlib import Path
+
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from modules.embed_cache import VectorIndex
+
+
+def test_vector_index_repeated_id_in_one_batch():
+    index = VectorIndex()
+    index.add(["a", "b", "a"], [[1.0, 0.0], [0.0, 1.0], [0.0, 2.0]])
+
+    assert len(index) == 2
+    # The later vector for "a" wins
+    assert index.search([0.0, 1.0], 2)[0][1] == 1.0
+    assert {doc_id for doc_id, _ in index.search([0.0, 1.0], 2)} == {"a", "b"}
+
+    # Same on a non-empty index: "c" is pending when it repeats
+    index.add(["c", "c"], [[1.0, 0.0], [-1.0, 0.0]])
+    assert len(index) == 3
+    assert index.search([-1.0, 0.0], 1) == [("c", 1.0)]
+
+
+def test_vector_index_grows_and_replaces_rows():
+    index = VectorIndex(capacity=2)
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 8))
+    for start in range(0, 50, 7):
+        index.add(list(range(start, min(start + 7, 50))), vectors[start:start + 7])
+
+    assert len(index) == 50
+    for i in (0, 17, 49):
+        assert index.search(vectors[i], 1)[0][0] == i
+
+    # Replacing an existing row does not add one
+    index.add([3], [vectors[40]])
+    assert len(index) == 50
+    assert {doc_id for doc_id, _ in index.search(vectors[40], 2)} == {3, 40}
+
+
+def test_vector_index_skips_bad_vectors():
+    index = VectorIndex()
+    index.add(["zero", "ok", "wrong_dim", "none"], [[0.0, 0.0], [1.0, 0.0], [1.0, 0.0, 0.0], None])
+
+    assert len(index) == 1
+    assert index.search([1.0, 0.0, 0.0], 1) == []
+    assert index.search([1.0, 0.0], 5) == [("ok", 1.0)]
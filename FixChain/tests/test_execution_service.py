@@ -0,0 +1,105 @@
+import importlib.util
+import json
+from pathlib import Path
+
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+import modules.execution as execution
+from modules.execution import ExecutionService
+
+EXPORT_SCRIPT = Path(__file__).resolve().parents[2] / "SonarQ" / "export_issues.py"
+
+ISSUES = [
+    {
+        "key": f"AX-{i}",
+        "rule": "python:S1481" if i % 2 else "python:S5754",
+        "severity": "MAJOR",
+        "type": "CODE_SMELL" if i % 2 else "BUG",
+        "component": "demo:src/code.py",
+        "line": i + 1 if i != 2 else None,
+        "message": f"Issue {i}",
+        "status": "OPEN",
+        "creationDate": "2026-01-01T00:00:00+0000",
+        "updateDate": "2026-01-02T00:00:00+0000",
+    }
+    for i in range(5)
+]
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+        self.content = json.dumps(payload).encode("utf-8")
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSonar:
+    """In-memory stand-in for the SonarQube Web API endpoints both clients use"""
+
+    def __init__(self, issues):
+        self.issues = issues
+        self.auth = None
+        self.calls = []
+
+    def get(self, url, params=None, **kwargs):
+        path = url.split("://", 1)[-1].split("/", 1)[1]
+        self.calls.append((path, dict(params or {})))
+        if path == "api/issues/search":
+            page, size = int(params["p"]), int(params["ps"])
+            return FakeResponse({
+                "total": len(self.issues),
+                "issues": self.issues[(page - 1) * size:page * size],
+            })
+        if path == "api/rules/show":
+            return FakeResponse({"rule": {"htmlDesc": f"<p>About {params['key']}</p>"}})
+        if path == "api/sources/lines":
+            return FakeResponse({"sources": [
+                {"line": n, "code": f"line_{n}"} for n in range(int(params["from"]), int(params["to"]) + 1)
+            ]})
+        raise AssertionError(f"unexpected call {path}")
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv("SONAR_TOKEN", "token")
+    monkeypatch.setenv("PROJECT_KEY", "demo")
+    monkeypatch.setattr(execution, "MongoDBService", lambda: None)
+    monkeypatch.setattr(execution, "SONAR_PAGE_SIZE", 2)
+    svc = ExecutionService()
+    svc._http = FakeSonar(ISSUES)
+    return svc
+
+
+def test_fetch_issues_pages_through_all_results(service):
+    bugs = service._fetch_issues_via_api()
+
+    assert [bug["bug_id"] for bug in bugs] == [issue["key"] for issue in ISSUES]
+    pages = [params["p"] for path, params in service._http.calls if path == "api/issues/search"]
+    assert pages == [1, 2, 3]
+    # Rule descriptions are fetched once per rule and reused on the next scan
+    service._fetch_issues_via_api()
+    rule_calls = [params["key"] for path, params in service._http.calls if path == "api/rules/show"]
+    assert sorted(rule_calls) == ["python:S1481", "python:S5754"]
+
+
+def test_fetch_issues_matches_export_issues_output(service, monkeypatch, capsysbinary):
+    monkeypatch.setenv("SONAR_TOKEN", "token")
+    spec = importlib.util.spec_from_file_location("export_issues", EXPORT_SCRIPT)
+    export_issues = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(export_issues)
+    monkeypatch.setattr(export_issues.requests, "Session", lambda: FakeSonar(ISSUES))
+    monkeypatch.setattr(sys, "argv", ["export_issues.py", "demo", "http://sonar.test"])
+
+    export_issues.main()
+    expected = json.loads(capsysbinary.readouterr().out)["issues"]
+
+    assert service._fetch_issues_via_api() == expected
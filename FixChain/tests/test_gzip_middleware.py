@@ -0,0 +1,93 @@
+import asyncio
+import gzip
+from pathlib import Path
+
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from starlette.applications import Starlette
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from utils.gzip_middleware import StreamingAwareGZipMiddleware
+
+
+def _make_app(middleware, sent, seen_before_second_event):
+    async def events():
+        yield "data: one\n\n"
+        # Snapshot of the body bytes the client already got before the next event
+        seen_before_second_event.extend(
+            m.get("body", b"") for m in sent if m["type"] == "http.response.body"
+        )
+        yield "data: two\n\n"
+
+    async def stream(request):
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def big(request):
+        return JSONResponse({"items": ["x" * 50] * 100})
+
+    return middleware(Starlette(routes=[Route("/stream", stream), Route("/big", big)]), minimum_size=1024)
+
+
+def _request(app, path, sent):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"accept-encoding", b"gzip"), (b"host", b"test")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("test", 80),
+    }
+
+    async def receive():
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    headers = dict(sent[0]["headers"])
+    body = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    return headers, body
+
+
+def test_event_stream_is_flushed_per_event():
+    sent, seen = [], []
+    app = _make_app(StreamingAwareGZipMiddleware, sent, seen)
+
+    headers, body = _request(app, "/stream", sent)
+
+    assert b"content-encoding" not in headers
+    assert b"".join(seen) == b"data: one\n\n"
+    assert body == b"data: one\n\ndata: two\n\n"
+
+
+def test_plain_gzip_middleware_holds_back_events():
+    # Documents why the wrapper exists: stock GZip emits no event bytes until close
+    sent, seen = [], []
+    app = _make_app(GZipMiddleware, sent, seen)
+
+    headers, body = _request(app, "/stream", sent)
+
+    assert headers[b"content-encoding"] == b"gzip"
+    assert b"data: one" not in b"".join(seen)
+    assert gzip.decompress(body) == b"data: one\n\ndata: two\n\n"
+
+
+def test_large_json_is_still_gzipped():
+    sent = []
+    app = _make_app(StreamingAwareGZipMiddleware, sent, [])
+
+    headers, body = _request(app, "/big", sent)
+
+    assert headers[b"content-encoding"] == b"gzip"
+    assert gzip.decompress(body).startswith(b'{"items"')
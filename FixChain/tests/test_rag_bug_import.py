@@ -0,0 +1,115 @@
+import asyncio
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import pytest
+from bson import ObjectId
+
+import controller.rag_bug_controller as rag_bug_controller
+from controller.rag_bug_controller import BugRAGImportRequest, BugRAGItem
+
+
+class FakeCollection:
+    """Just enough of a pymongo collection for the import path"""
+
+    name = "bug_rag_documents"
+
+    def __init__(self):
+        self.docs = {}
+        self.before_write = None  # hook to simulate a concurrent import
+
+    def create_index(self, *args, **kwargs):
+        return kwargs.get("name")
+
+    def find(self, filter, projection=None):
+        wanted = set(filter["content_hash"]["$in"])
+        out = []
+        for doc in self.docs.values():
+            if doc.get("content_hash") in wanted:
+                out.append({
+                    "_id": doc["_id"],
+                    "content_hash": doc["content_hash"],
+                    "has_embedding": isinstance(doc.get("embedding"), list),
+                })
+        return out
+
+    def bulk_write(self, operations, ordered=True):
+        if self.before_write:
+            self.before_write(self)
+        upserted = {}
+        for index, op in enumerate(operations):
+            flt, update = op._filter, op._doc
+            if "_id" in flt:
+                self.docs[flt["_id"]].update(update.get("$set", {}))
+                continue
+            match = next((d for d in self.docs.values() if d.get("content_hash") == flt["content_hash"]), None)
+            if match is None and op._upsert:
+                doc = dict(update["$setOnInsert"])
+                self.docs[doc["_id"]] = doc
+                upserted[index] = doc["_id"]
+        return SimpleNamespace(acknowledged=True, upserted_ids=upserted)
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    coll = FakeCollection()
+    monkeypatch.setattr(
+        rag_bug_controller, "get_mongo_manager", lambda: SimpleNamespace(get_collection=lambda name: coll)
+    )
+    embed_calls = []
+
+    async def fake_embed(texts, batch_size=64):
+        embed_calls.append(list(texts))
+        return [[0.1, 0.2, 0.3] for _ in texts]
+
+    monkeypatch.setattr(rag_bug_controller, "generate_gemini_embeddings_batch", fake_embed)
+    coll.embed_calls = embed_calls
+    return coll
+
+
+def _import(bugs):
+    request = BugRAGImportRequest(bugs=[BugRAGItem(name=n, description=d) for n, d in bugs])
+    return asyncio.run(rag_bug_controller.import_bugs_as_rag(request))
+
+
+def test_import_reports_imported_duplicate_and_unchanged(collection):
+    first = _import([("A", "a"), ("B", "b"), ("A", "a")])
+    assert [b["status"] for b in first["imported_bugs"]] == ["imported", "imported", "duplicate"]
+    assert first["imported_bugs"][0]["bug_id"] == first["imported_bugs"][2]["bug_id"]
+    assert first["total_new"] == 2
+    assert len(collection.docs) == 2
+    assert len(collection.embed_calls) == 1 and len(collection.embed_calls[0]) == 2
+
+    second = _import([("A", "a"), ("C", "c")])
+    assert [b["status"] for b in second["imported_bugs"]] == ["unchanged", "imported"]
+    assert second["imported_bugs"][0]["bug_id"] == first["imported_bugs"][0]["bug_id"]
+    # Only the new content is embedded
+    assert collection.embed_calls[-1] == [rag_bug_controller.format_bug_for_rag(BugRAGItem(name="C", description="c"))]
+
+
+def test_import_reports_stored_id_when_a_concurrent_import_wins(collection):
+    content = rag_bug_controller.format_bug_for_rag(BugRAGItem(name="A", description="a"))
+    winner_id = ObjectId()
+
+    def concurrent_insert(coll):
+        coll.docs[winner_id] = {
+            "_id": winner_id,
+            "content": content,
+            "content_hash": rag_bug_controller.content_hash(content),
+            "embedding": [1.0, 0.0, 0.0],
+        }
+        coll.before_write = None
+
+    collection.before_write = concurrent_insert
+
+    result = _import([("A", "a")])
+
+    assert result["imported_bugs"][0]["bug_id"] == str(winner_id)
+    assert result["imported_bugs"][0]["status"] == "unchanged"
+    assert result["total_new"] == 0
+    assert list(collection.docs) == [winner_id]
@@ -0,0 +1,82 @@
+import asyncio
+import os
+from pathlib import Path
+
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import numpy as np
+import pytest
+from pymongo.errors import BulkWriteError
+
+import controller.rag_controller as rag_controller
+from controller.rag_controller import DocumentBatchInput, DocumentInput
+from modules.mongodb_service import MongoDBManager, dequantize_vector
+
+
+class FakeCollection:
+    def __init__(self, fail_indexes=()):
+        self.fail_indexes = set(fail_indexes)
+        self.inserted = []
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        errors = []
+        for i, doc in enumerate(documents):
+            if i in self.fail_indexes:
+                errors.append({"index": i, "code": 11000, "errmsg": f"duplicate key {i}"})
+            else:
+                self.inserted.append(doc)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(documents) - len(errors)})
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    mgr = MongoDBManager.__new__(MongoDBManager)
+    mgr.documents_collection = FakeCollection(fail_indexes={1})
+    mgr.embeddings_collection = FakeCollection()
+    monkeypatch.setattr(rag_controller, "mongo_manager", mgr)
+
+    embed_calls = []
+
+    async def fake_embeddings(texts, use_cache=True):
+        embed_calls.append(list(texts))
+        return [[float(len(text)), 1.0, 0.5] for text in texts]
+
+    monkeypatch.setattr(rag_controller, "get_gemini_embeddings", fake_embeddings)
+    mgr.embed_calls = embed_calls
+    return mgr
+
+
+def _batch(*contents):
+    return DocumentBatchInput(docs=[DocumentInput(content=c, metadata={"n": i}) for i, c in enumerate(contents)])
+
+
+def test_add_batch_reports_failed_documents(manager):
+    contents = ["first document text", "second document that fails", "third document text!"]
+
+    result = asyncio.run(rag_controller.add_documents_batch(_batch(*contents)))
+
+    assert result["message"] == "Added 2/3 documents"
+    assert list(result["errors"]) == ["1"]
+    assert "duplicate key 1" in result["errors"]["1"]
+    assert result["document_ids"][1] is None
+    assert all(result["document_ids"][i] for i in (0, 2))
+
+    # Embeddings are stored only for documents that were written, in input order
+    stored = manager.embeddings_collection.inserted
+    assert [doc["doc_id"] for doc in stored] == [result["document_ids"][0], result["document_ids"][2]]
+    vector = dequantize_vector(stored[0]["vector"], stored[0]["dtype"], stored[0]["scale"])
+    expected = np.array([len(contents[0]), 1.0, 0.5], dtype=np.float32)
+    assert np.allclose(vector, expected / np.linalg.norm(expected), atol=0.01)
+
+
+def test_add_batch_embeds_in_one_call_for_small_batches(manager):
+    manager.documents_collection.fail_indexes = set()
+
+    result = asyncio.run(rag_controller.add_documents_batch(_batch("a" * 30, "b" * 10, "c" * 20)))
+
+    assert result["errors"] == {}
+    assert len(manager.embed_calls) == 1
+    assert sorted(manager.embed_calls[0], key=len) == manager.embed_calls[0]